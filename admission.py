@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+"""
+admission.py -- queued admission for high-demand ("hot") conferences
+
+Instead of running one registration transaction per request, requests for
+hot conferences are stored as a RegistrationTicket (child of the user's
+Profile) and a pull task tagged with the conference key. A worker leases
+the tasks of one conference and admits them in batches of
+ADMISSION_BATCH, each batch in a single cross-group transaction covering
+the batch's profiles and a few seat shards. Clients poll the ticket with
+getRegistrationStatus. Tickets are keyed by the conference, so a user
+has at most one pending ticket per conference.
+"""
+
+import collections
+import time
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import RegistrationTicket
+
+import caching
+import registrations
+import seats
+
+ADMISSION_QUEUE = 'registrations'
+# profiles + seat shards of one batch must stay below the limit of
+# 25 entity groups per cross-group transaction
+ADMISSION_BATCH = 10
+LEASE_SECONDS = 60
+MAX_LEASE = 100
+KICK_INTERVAL = 2   # seconds
+
+
+def ticketKey(p_key, wsck):
+    """Return the key of the user's ticket for a conference."""
+    return ndb.Key(RegistrationTicket, wsck, parent=p_key)
+
+
+@ndb.transactional()
+def _storeTicket(p_key, wsck):
+    """Return the user's pending ticket for the conference, storing and
+    queueing a new one unless a ticket is already pending."""
+    t_key = ticketKey(p_key, wsck)
+    ticket = t_key.get()
+    if ticket and ticket.status == 'PENDING':
+        return ticket
+    ticket = RegistrationTicket(key=t_key, conference=wsck)
+    ticket.put()
+    taskqueue.Queue(ADMISSION_QUEUE).add(taskqueue.Task(
+        payload=t_key.urlsafe(), method='PULL', tag=wsck),
+        transactional=True)
+    return ticket
+
+
+def enqueue(p_key, wsck):
+    """Store a pending ticket for the user and queue it for admission;
+    repeated requests get the ticket already pending."""
+    ticket = _storeTicket(p_key, wsck)
+    kick(wsck)
+    return ticket
+
+
+def kick(wsck):
+    """Enqueue (at most once per KICK_INTERVAL) a worker for a conference."""
+    name = 'admit-%s-%d' % (wsck, int(time.time() / KICK_INTERVAL))
+    try:
+        taskqueue.add(name=name, params={'websafeConferenceKey': wsck},
+                      url='/tasks/admit_registrations',
+                      countdown=KICK_INTERVAL)
+    except (taskqueue.TaskAlreadyExistsError,
+            taskqueue.TombstonedTaskError):
+        pass
+
+
+@ndb.transactional(xg=True)
+def _admitBatch(wsck, ticket_keys, shard_keys):
+    """Admit a batch of tickets, taking seats from the given shards."""
+    # a ticket or profile appearing twice must be one object, so the
+    # second request sees the registration of the first
+    ticket_keys = list(collections.OrderedDict.fromkeys(ticket_keys))
+    tickets = [t for t in ndb.get_multi(ticket_keys)
+               if t and t.status == 'PENDING']
+    p_keys = list(collections.OrderedDict.fromkeys(
+        t.key.parent() for t in tickets))
+    profiles = dict(zip(p_keys, ndb.get_multi(p_keys)))
+    shards = [s for s in ndb.get_multi(shard_keys) if s]
+    regs = []
+
+    for ticket in tickets:
+        prof = profiles[ticket.key.parent()]
+        shard = next((s for s in shards if s.seatsAvailable > 0), None)
+        if not prof:
+            ticket.status, ticket.reason = 'REJECTED', 'No profile found'
+        elif wsck in prof.conferenceKeysToAttend:
+            ticket.status = 'REJECTED'
+            ticket.reason = 'You have already registered for this conference'
+        elif not shard:
+            ticket.status, ticket.reason = 'REJECTED', \
+                'There are no seats available.'
+        else:
+            prof.conferenceKeysToAttend.append(wsck)
+            shard.seatsAvailable -= 1
+            shard.attendees += 1
+            regs.append(registrations.newRegistration(prof, wsck))
+            ticket.status = 'REGISTERED'
+
+    ndb.put_multi(tickets + [p for p in profiles.values() if p] +
+                  shards + regs)
+    return [t for t in tickets if t.status == 'REGISTERED']
+
+
+def process(wsck=None):
+    """Lease and admit queued registrations of one conference (the one
+    of the first queued task if wsck is None); return number processed."""
+    queue = taskqueue.Queue(ADMISSION_QUEUE)
+    tasks = queue.lease_tasks_by_tag(LEASE_SECONDS, MAX_LEASE, tag=wsck)
+    if not tasks:
+        return 0
+    wsck = tasks[0].tag
+
+    conf = ndb.Key(urlsafe=wsck).get()
+    if conf:
+        conf = seats.ensureShards(conf)
+    for i in range(0, len(tasks), ADMISSION_BATCH):
+        batch = tasks[i:i + ADMISSION_BATCH]
+        ticket_keys = [ndb.Key(urlsafe=task.payload) for task in batch]
+        shard_keys = seats.fullestShards(conf, ADMISSION_BATCH) \
+            if conf else []
+        admitted = _admitBatch(wsck, ticket_keys, shard_keys)
+        caching.invalidateProfiles(
+            [ticket.key.parent().id() for ticket in admitted])
+        # processed tickets are no longer pending, so a batch that fails
+        # after this point is safely re-admitted once its lease expires
+        queue.delete_tasks(batch)
+
+    seats.scheduleReconcile(wsck)
+    if len(tasks) == MAX_LEASE:
+        kick(wsck)
+    return len(tasks)
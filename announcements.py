@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+"""
+announcements.py -- incrementally maintained "nearly sold out" announcement
+
+The conferences with 1 to NEARLY_SOLD_OUT_SEATS available seats are kept
+in a single NearlySoldOut entity. Every writer of
+Conference.seatsAvailable (seat reconciliation after registrations,
+conference creation and updates) calls update(), which only touches the
+entity when the conference crosses the threshold (or a listed conference
+is renamed), in the writer's transaction. After the commit the
+announcement text is rebuilt from the entity and published through the
+instance cache of caching.py.
+
+reconcile() recomputes the list with one query; the hourly cron runs it
+to repair announcements missed (e.g. by eviction from memcache).
+"""
+
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import NearlySoldOut
+
+import caching
+
+NEARLY_SOLD_OUT_SEATS = 5
+MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
+ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
+                    'are nearly sold out: %s')
+
+
+def _key():
+    """Return the key of the NearlySoldOut singleton."""
+    return ndb.Key(NearlySoldOut, 'all')
+
+
+def isNearlySoldOut(seats):
+    """Return True if a conference with seats available is announced."""
+    return 0 < (seats or 0) <= NEARLY_SOLD_OUT_SEATS
+
+
+def publish():
+    """Rebuild the announcement from the NearlySoldOut entity and set it
+    in memcache; return the announcement."""
+    entry = _key().get()
+    if entry and entry.names:
+        announcement = ANNOUNCEMENT_TPL % ', '.join(entry.names)
+        caching.setGlobal(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
+    else:
+        announcement = ""
+        caching.deleteGlobal(MEMCACHE_ANNOUNCEMENTS_KEY)
+    return announcement
+
+
+@ndb.transactional(propagation=ndb.TransactionOptions.ALLOWED)
+def _store(wsck, name):
+    """Replace (name None: remove) the entry of conference wsck."""
+    entry = _key().get() or NearlySoldOut(key=_key())
+    pairs = [(k, n) for k, n in zip(entry.conferences, entry.names)
+             if k != wsck]
+    if name is not None:
+        pairs.append((wsck, name))
+    entry.conferences = [k for k, _ in pairs]
+    entry.names = [n for _, n in pairs]
+    entry.put()
+    # re-read after the commit, so the last callback publishes the
+    # latest list even if commits finish out of order
+    ndb.get_context().call_on_commit(publish)
+
+
+def update(conf, old_seats=None, old_name=None):
+    """Add or remove conf in the announcement after its seatsAvailable
+    changed from old_seats (or its name from old_name). Call it in the
+    (cross-group) transaction writing conf, if there is one. Returns
+    True if the announcement changed."""
+    listed = isNearlySoldOut(conf.seatsAvailable)
+    if listed == isNearlySoldOut(old_seats) and \
+            (not listed or conf.name == old_name):
+        return False
+    _store(conf.key.urlsafe(), conf.name if listed else None)
+    return True
+
+
+def reconcile():
+    """Recompute the nearly sold out conferences with a query, store
+    them and publish the announcement; return the announcement."""
+    confs = Conference.query(ndb.AND(
+        Conference.seatsAvailable <= NEARLY_SOLD_OUT_SEATS,
+        Conference.seatsAvailable > 0)
+    ).fetch(projection=[Conference.name])
+    wscks = [conf.key.urlsafe() for conf in confs]
+    names = [conf.name for conf in confs]
+
+    @ndb.transactional()
+    def _replace():
+        entry = _key().get() or NearlySoldOut(key=_key())
+        if sorted(zip(entry.conferences, entry.names)) != \
+                sorted(zip(wscks, names)):
+            entry.conferences = wscks
+            entry.names = names
+            entry.put()
+
+    _replace()
+    return publish()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+
+"""
+bench_endpoints.py -- ConferenceApi benchmark on the testbed stubs
+
+Seeds a deterministic dataset (see dataset.py) into the datastore,
+memcache and taskqueue stubs and calls ConferenceApi methods directly.
+Every scenario runs with cold caches (memcache and instance caches
+flushed before each call) and warm. For each run the latency, the API
+calls by service and method, and the size of the JSON response are
+recorded and written to a JSON file; with --baseline the medians are
+compared to an earlier run. Run from the project directory with the
+App Engine SDK on PYTHONPATH:
+
+    python benchmarks/bench_endpoints.py [-o results.json]
+        [--baseline baseline.json] [--conferences N] [--sessions M] ...
+"""
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('APPLICATION_ID', 'dev~bench')
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+from protorpc import message_types
+from protorpc import protojson
+
+import caching
+import conference
+from conference import ConferenceApi
+from models import ConferenceQueryForm
+from models import ConferenceQueryForms
+from models import SessionForm
+from models import SessionQueryForm
+from models import SessionQueryForms
+
+import dataset
+
+
+def setUpStubs():
+    """Activate and return a testbed with all stubs the API uses."""
+    bed = testbed.Testbed()
+    bed.activate()
+    policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+        probability=1)
+    bed.init_datastore_v3_stub(consistency_policy=policy)
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub(root_path=ROOT)
+    bed.init_app_identity_stub()
+    bed.init_urlfetch_stub()
+    bed.init_user_stub()
+    bed.init_mail_stub()
+    return bed
+
+
+class RpcCounter(object):
+    """RpcCounter -- counts API calls while active"""
+
+    def __init__(self):
+        self.calls = None
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+            'bench', self.hook)
+
+    def hook(self, service, call, request, response):
+        if self.calls is not None:
+            name = '%s.%s' % (service, call)
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def start(self):
+        self.calls = {}
+
+    def stop(self):
+        calls, self.calls = self.calls, None
+        return calls
+
+
+def coldCaches():
+    """Flush memcache and the instance caches."""
+    memcache.flush_all()
+    caching._profiles.clear()
+    caching._globals.clear()
+
+
+def signIn(email):
+    """Make endpoints.get_current_user() return the user email."""
+    os.environ['ENDPOINTS_AUTH_EMAIL'] = email
+    os.environ['ENDPOINTS_AUTH_DOMAIN'] = 'example.com'
+
+
+def scenarios(data):
+    """Return (name, method, request factory, user factory) of all
+    scenarios; factories get the iteration number."""
+    conf = lambda i: data.conferences[i % len(data.conferences)]
+    user = lambda i: data.users[i % len(data.users)]
+    organizer = lambda i: data.organizers[0]
+    void = lambda i: message_types.VoidMessage()
+    # registrations need a new user for every call
+    newUser = itertools.count()
+    return [
+        ('getConference', 'getConference', lambda i:
+            conference.CONF_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=conf(i)), user),
+        ('getConferencesCreated', 'getConferencesCreated', lambda i:
+            conference.LIST_GET_REQUEST.combined_message_class(),
+            lambda i: data.organizers[i % len(data.organizers)]),
+        ('getConferencesToAttend', 'getConferencesToAttend', lambda i:
+            conference.LIST_GET_REQUEST.combined_message_class(), user),
+        ('getConferencesToAttendList', 'getConferencesToAttendList', void,
+            user),
+        ('queryConferences', 'queryConferences', lambda i:
+            ConferenceQueryForms(filters=[ConferenceQueryForm(
+                field='CITY', operator='EQ',
+                value=dataset.CITIES[i % len(dataset.CITIES)])]), user),
+        ('queryConferences[NE]', 'queryConferences', lambda i:
+            ConferenceQueryForms(filters=[ConferenceQueryForm(
+                field='MAX_ATTENDEES', operator='NE', value='100')]), user),
+        ('queryConferencesList', 'queryConferencesList', lambda i:
+            ConferenceQueryForms(filters=[ConferenceQueryForm(
+                field='CITY', operator='EQ',
+                value=dataset.CITIES[i % len(dataset.CITIES)])]), user),
+        ('getConferenceAttendees', 'getConferenceAttendees', lambda i:
+            conference.ATTENDEES_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=conf(i)), user),
+        ('getConferenceSessions', 'getConferenceSessions', lambda i:
+            conference.SESSIONS_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=conf(i)), user),
+        ('getConferenceSessions[keys,names]', 'getConferenceSessions',
+            lambda i: conference.SESSIONS_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=conf(i),
+                fieldMask=['websafeKey', 'name']), user),
+        ('getSessionsBySpeaker', 'getSessionsBySpeaker', lambda i:
+            conference.SPEAKER_SESSIONS_GET_REQUEST.combined_message_class(
+                websafeSpeakerKey=data.speakers[i % len(data.speakers)]),
+            user),
+        ('getSessionsInWishlist', 'getSessionsInWishlist', lambda i:
+            conference.LIST_GET_REQUEST.combined_message_class(), user),
+        ('getSpeakers', 'getSpeakers', lambda i:
+            conference.LIST_GET_REQUEST.combined_message_class(), user),
+        ('querySessions', 'querySessions', lambda i:
+            SessionQueryForms(filters=[
+                SessionQueryForm(field='sessionType', operator='NE',
+                                 value='WORKSHOP'),
+                SessionQueryForm(field='startTime', operator='LT',
+                                 value='19:00')]), user),
+        ('getProfile', 'getProfile', void, user),
+        ('registerForConference', 'registerForConference', lambda i:
+            conference.CONF_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=conf(i)),
+            lambda i: 'bench%04d@example.com' % next(newUser)),
+        ('createSessions[20]', 'createSessions', lambda i:
+            conference.SESSIONS_POST_REQUEST.combined_message_class(
+                websafeConferenceKey=data.conferences[0],
+                sessions=[SessionForm(name='Bench %d-%d' % (i, j),
+                                      speaker=data.speakers[j % len(
+                                          data.speakers)])
+                          for j in range(20)]), organizer),
+    ]
+
+
+def _percentile(values, percentile):
+    """Return percentile of sorted values (nearest rank)."""
+    index = int(round(percentile / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+def run(data, counter, repeat):
+    """Run all scenarios cold and warm; return results by name."""
+    api = ConferenceApi()
+    results = {}
+    for name, method, makeRequest, makeUser in scenarios(data):
+        for cold in (True, False):
+            latencies, rpcs, sizes = [], {}, []
+            for i in range(repeat):
+                # every request starts with an empty ndb context cache
+                ndb.get_context().clear_cache()
+                if cold:
+                    coldCaches()
+                request = makeRequest(i)
+                signIn(makeUser(i))
+                counter.start()
+                start = time.time()
+                response = getattr(api, method)(request)
+                latencies.append((time.time() - start) * 1000)
+                for call, n in counter.stop().items():
+                    rpcs[call] = rpcs.get(call, 0) + n
+                sizes.append(len(protojson.encode_message(response)))
+            latencies.sort()
+            results['%s (%s)' % (name, 'cold' if cold else 'warm')] = {
+                'latency_ms': {
+                    'min': round(latencies[0], 3),
+                    'median': round(_percentile(latencies, 50), 3),
+                    'p95': round(_percentile(latencies, 95), 3),
+                    'max': round(latencies[-1], 3),
+                },
+                'rpcs': dict((call, float(n) / repeat)
+                             for call, n in rpcs.items()),
+                'rpc_total': float(sum(rpcs.values())) / repeat,
+                'response_bytes': sum(sizes) / repeat,
+            }
+    return results
+
+
+def compare(results, baseline):
+    """Print median latency and RPC count changes against baseline."""
+    print('%-45s %12s %12s' % ('scenario', 'median', 'rpcs'))
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        new, old = results[name], baseline[name]
+        print('%-45s %+11.1f%% %+12.1f' % (
+            name,
+            (new['latency_ms']['median'] / max(
+                old['latency_ms']['median'], 1e-6) - 1) * 100,
+            new['rpc_total'] - old['rpc_total']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-o', '--output', default='bench_endpoints.json')
+    parser.add_argument('--baseline')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--conferences', type=int, default=20)
+    parser.add_argument('--sessions', type=int, default=10)
+    parser.add_argument('--speakers', type=int, default=30)
+    parser.add_argument('--profiles', type=int, default=200)
+    parser.add_argument('--attending', type=int, default=3)
+    parser.add_argument('--wishlist', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    bed = setUpStubs()
+    try:
+        data = dataset.seed(
+            conferences=args.conferences, sessions=args.sessions,
+            speaker_count=args.speakers, profiles=args.profiles,
+            attending=args.attending, wishlist=args.wishlist,
+            random_seed=args.seed)
+        results = run(data, RpcCounter(), args.repeat)
+    finally:
+        bed.deactivate()
+
+    params = dict(vars(args))
+    for name in ('output', 'baseline'):
+        del params[name]
+    with open(args.output, 'w') as f:
+        json.dump({'params': params, 'results': results}, f, indent=2,
+                  sort_keys=True)
+    print('results written to %s' % args.output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f)['results'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+"""
+bench_serializers.py -- micro-benchmark of the precompiled serializers
+
+Compares the former per-entity all_fields() loop of _copySessionToForm
+with serializers.sessionSerializer on in-memory Session entities.
+Run from the project directory with the App Engine SDK on PYTHONPATH:
+
+    python benchmarks/bench_serializers.py [entities] [repeat]
+"""
+
+import os
+import sys
+import timeit
+from datetime import date, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+os.environ.setdefault('APPLICATION_ID', 'dev~bench')
+
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Session
+from models import SessionForm
+from serializers import sessionSerializer
+
+
+def legacyCopySessionToForm(session):
+    """Former implementation of ConferenceApi._copySessionToForm."""
+    sf = SessionForm()
+    for field in sf.all_fields():
+        if hasattr(session, field.name):
+            if field.name.endswith('Date') or field.name.endswith('Time'):
+                setattr(sf, field.name, str(getattr(session, field.name)))
+            else:
+                setattr(sf, field.name, getattr(session, field.name))
+        elif field.name == "websafeKey":
+            setattr(sf, field.name, session.key.urlsafe())
+    sf.check_initialized()
+    return sf
+
+
+def makeSessions(count):
+    """Return count in-memory Session entities."""
+    conf_key = ndb.Key(Conference, 1)
+    return [Session(key=ndb.Key(Session, i + 1, parent=conf_key),
+                    name='Session %d' % i, description='x' * 200,
+                    topics=['Topic A', 'Topic B'], highlights=['h1'],
+                    sessionType='LECTURE', location='Room 1',
+                    startDate=date(2015, 11, 12), startTime=time(19, 0),
+                    duration=60, speaker='speakerKey')
+            for i in range(count)]
+
+
+def main(count=500, repeat=20):
+    sessions = makeSessions(count)
+    legacy = min(timeit.repeat(
+        lambda: [legacyCopySessionToForm(s) for s in sessions],
+        number=1, repeat=repeat))
+    compiled = min(timeit.repeat(
+        lambda: sessionSerializer.toForms(sessions),
+        number=1, repeat=repeat))
+    print('legacy:   %.1f us/entity' % (legacy / count * 1e6))
+    print('compiled: %.1f us/entity' % (compiled / count * 1e6))
+    print('speedup:  %.2fx' % (legacy / compiled))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+"""
+dataset.py -- deterministic synthetic dataset for the benchmarks
+
+seed() creates profiles, speakers, conferences (children of their
+organizers' profiles) and their sessions, registers every profile for a
+few conferences and fills its wishlist with sessions of them. The same
+arguments always produce the same entities and keys. Derived entities
+(seat shards, registrations, wishlist entries, speaker session counts)
+are created as the application would maintain them.
+"""
+
+import random
+from datetime import date, time, timedelta
+
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Profile
+from models import Session
+from models import SessionType
+from models import Speaker
+from models import TeeShirtSize
+
+import registrations
+import seats
+import speakers
+import wishlists
+
+CITIES = ('London', 'Chicago', 'Paris', 'Tokyo', 'Berlin', 'Sydney',
+          'San Francisco', 'Default City')
+TOPICS = ('Medical Innovations', 'Programming Languages', 'Web Technologies',
+          'Movie Making', 'Health and Nutrition')
+COMPANIES = ('Acme', 'Initech', 'Globex', 'Umbrella', None)
+
+
+class Dataset(object):
+    """Dataset -- websafe keys and user ids of a seeded dataset"""
+
+    def __init__(self):
+        self.users = []
+        self.organizers = []
+        self.speakers = []
+        self.conferences = []
+        self.sessions = []
+
+
+def userEmail(i):
+    """Return email (and user id) of synthetic user i."""
+    return 'user%04d@example.com' % i
+
+
+def seed(conferences=20, sessions=10, speaker_count=30, profiles=200,
+         organizers=10, attending=3, wishlist=8, random_seed=1):
+    """Create the synthetic dataset in the datastore; return Dataset."""
+    rnd = random.Random(random_seed)
+    data = Dataset()
+    sizes = TeeShirtSize.names()
+
+    profs = [Profile(key=ndb.Key(Profile, userEmail(i)),
+                     displayName='User %d' % i, mainEmail=userEmail(i),
+                     teeShirtSize=rnd.choice(sizes))
+             for i in range(profiles)]
+    data.users = [prof.key.id() for prof in profs]
+    data.organizers = data.users[:organizers]
+
+    spks = [Speaker(key=ndb.Key(Speaker, i + 1),
+                    firstName='First%d' % i, familyName='Family%d' % i,
+                    company=rnd.choice(COMPANIES),
+                    expertise=rnd.sample(TOPICS, 2))
+            for i in range(speaker_count)]
+    data.speakers = [sp.key.urlsafe() for sp in spks]
+
+    confs, all_sessions = [], []
+    for i in range(conferences):
+        start = date(2016, 1, 1) + timedelta(days=rnd.randint(0, 364))
+        max_attendees = rnd.choice((50, 100, 200, 500, 1000))
+        conf = Conference(
+            key=ndb.Key(Conference, i + 1,
+                        parent=ndb.Key(Profile, data.organizers[
+                            i % len(data.organizers)])),
+            name='Conference %03d' % i, description='Synthetic conference',
+            organizerUserId=data.organizers[i % len(data.organizers)],
+            topics=rnd.sample(TOPICS, rnd.randint(1, 3)),
+            city=rnd.choice(CITIES), startDate=start, month=start.month,
+            endDate=start + timedelta(days=rnd.randint(0, 3)),
+            maxAttendees=max_attendees, seatsAvailable=max_attendees)
+        confs.append(conf)
+        for j in range(sessions):
+            all_sessions.append(Session(
+                key=ndb.Key(Session, j + 1, parent=conf.key),
+                name='Session %03d-%02d' % (i, j),
+                description='Synthetic session',
+                topics=rnd.sample(TOPICS, 1),
+                sessionType=rnd.choice(SessionType.names()),
+                location='Room %d' % rnd.randint(1, 5), startDate=start,
+                startTime=time(rnd.randint(8, 20), rnd.choice((0, 30))),
+                duration=rnd.choice((30, 45, 60, 90)),
+                speaker=rnd.choice(data.speakers) if spks else ''))
+    data.conferences = [conf.key.urlsafe() for conf in confs]
+    data.sessions = [session.key.urlsafe() for session in all_sessions]
+
+    # registrations and wishlists
+    sessions_of = {}
+    for session in all_sessions:
+        sessions_of.setdefault(session.key.parent().urlsafe(), []).append(
+            session.key.urlsafe())
+    by_key = dict((conf.key.urlsafe(), conf) for conf in confs)
+    derived = []
+    for prof in profs:
+        for wsck in rnd.sample(data.conferences,
+                               min(attending, len(data.conferences))):
+            conf = by_key[wsck]
+            if conf.seatsAvailable <= 0:
+                continue
+            conf.seatsAvailable -= 1
+            prof.conferenceKeysToAttend.append(wsck)
+            derived.append(registrations.newRegistration(prof, wsck))
+        candidates = [wssk for wsck in prof.conferenceKeysToAttend
+                      for wssk in sessions_of.get(wsck, [])]
+        prof.sessionKeysWishlist = rnd.sample(
+            candidates, min(wishlist, len(candidates)))
+        derived.extend(wishlists.newEntry(prof.key, wssk)
+                       for wssk in prof.sessionKeysWishlist)
+
+    ndb.put_multi(profs + spks + [speakers.newSpeakerSessions(sp.key)
+                                  for sp in spks])
+    for conf in confs:
+        derived.extend(seats.createShards(conf))
+    ndb.put_multi(confs + all_sessions + derived)
+    speakers.addSessions([s for s in all_sessions if s.speaker])
+    return data
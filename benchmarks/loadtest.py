@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+
+"""
+loadtest.py -- concurrent load test of the WSGI apps on the testbed stubs
+
+Drives conference.api (through its /_ah/spi/ endpoints) and main.app
+in-process from a pool of threads, replaying a JSONL request trace or a
+generated mix of concurrent registrations for one small conference, hot
+queryConferences filters, wishlist churn of a few users and conference
+reads. Tasks enqueued meanwhile are executed against main.app by a
+background thread, as the task queue would.
+
+Trace lines are JSON objects with "app" ("api" or "main"), "path"
+(endpoint method name for "api"), "body" (JSON request of "api") or
+"params" (form parameters of "main"), optional "user" (email of the
+signed-in user) and optional "t" (start offset in seconds, honoured
+with --pace). Websafe keys of the seeded dataset are stable for a given
+seed, so recorded traces (--record) replay against the same dataset.
+
+Reports throughput, p50/p99 latency (overall and per path), response
+status counts and transaction retries (failed commits), and checks the
+datastore afterwards for oversold seats and lost updates of seat
+counters, registrations and wishlists. Run from the project directory
+with the App Engine SDK on PYTHONPATH:
+
+    python benchmarks/loadtest.py [--trace trace.jsonl | --requests N]
+        [--threads T] [--capacity C] [--record out.jsonl] [-o out.json]
+"""
+
+import argparse
+import json
+import os
+import Queue
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_endpoints import setUpStubs
+import dataset
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.ext import ndb
+from google.appengine.runtime import request_environment
+import webob
+
+import main
+import seats
+from conference import api
+from models import Conference
+from models import Profile
+from models import Registration
+from models import WishlistEntry
+
+API_PREFIX = '/_ah/spi/ConferenceApi.'
+HOT_CITIES = ('London', 'Paris')
+CHURN_USERS = 10
+
+
+class TransactionCounter(object):
+    """TransactionCounter -- counts transactions and failed commits"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.begun = self.commits = self.committed = 0
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'loadtest', self.before)
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+            'loadtest', self.after)
+
+    def before(self, service, call, request, response):
+        if service == 'datastore_v3' and call in (
+                'BeginTransaction', 'Commit'):
+            with self.lock:
+                if call == 'BeginTransaction':
+                    self.begun += 1
+                else:
+                    self.commits += 1
+
+    def after(self, service, call, request, response):
+        if service == 'datastore_v3' and call == 'Commit':
+            with self.lock:
+                self.committed += 1
+
+    def report(self):
+        return {'transactions': self.begun,
+                'commit_attempts': self.commits,
+                'failed_commits': self.commits - self.committed}
+
+
+def createHotConference(organizer, capacity):
+    """Create the small conference all registrations compete for."""
+    p_key = ndb.Key(Profile, organizer)
+    c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
+    conf = Conference(key=ndb.Key(Conference, c_id, parent=p_key),
+                      name='Load Test', organizerUserId=organizer,
+                      city='London', maxAttendees=capacity,
+                      seatsAvailable=capacity)
+    ndb.put_multi([conf] + seats.createShards(conf))
+    return conf.key.urlsafe()
+
+
+def generateMix(data, hot, count, rnd):
+    """Return count generated trace entries."""
+    entries = []
+    for i in range(count):
+        r = rnd.random()
+        if r < 0.3:
+            entries.append({'app': 'api', 'path': 'registerForConference',
+                            'body': {'websafeConferenceKey': hot},
+                            'user': 'load%05d@example.com' % i})
+        elif r < 0.55:
+            entries.append({'app': 'api', 'path': 'queryConferences',
+                            'body': {'filters': [{
+                                'field': 'CITY', 'operator': 'EQ',
+                                'value': rnd.choice(HOT_CITIES)}]},
+                            'user': rnd.choice(data.users)})
+        elif r < 0.85:
+            entries.append({'app': 'api', 'path': rnd.choice(
+                ('addSessionToWishlist', 'deleteSessionInWishlist')),
+                'body': {'websafeSessionKey': rnd.choice(data.sessions)},
+                'user': rnd.choice(data.users[:CHURN_USERS])})
+        else:
+            entries.append({'app': 'api', 'path': 'getConference',
+                            'body': {'websafeConferenceKey':
+                                     rnd.choice(data.conferences)},
+                            'user': rnd.choice(data.users)})
+    return entries
+
+
+def call(entry, base_env):
+    """Run one trace entry against its WSGI app; return status code,
+    latency (ms) and response body."""
+    if entry['app'] == 'api':
+        req = webob.Request.blank(
+            API_PREFIX + entry['path'], method='POST',
+            body=json.dumps(entry.get('body') or {}),
+            content_type='application/json')
+        app = api
+    elif 'payload' in entry:
+        req = webob.Request.blank(
+            entry['path'], method='POST', body=entry['payload'],
+            content_type='application/x-www-form-urlencoded')
+        app = main.app
+    else:
+        req = webob.Request.blank(entry['path'],
+                                  POST=entry.get('params') or {})
+        app = main.app
+    env = dict(base_env)
+    if entry.get('user'):
+        env['ENDPOINTS_AUTH_EMAIL'] = entry['user']
+        env['ENDPOINTS_AUTH_DOMAIN'] = 'example.com'
+    request_environment.current_request.Init(None, env)
+    ndb.get_context().clear_cache()
+    start = time.time()
+    resp = req.get_response(app)
+    return resp.status_int, (time.time() - start) * 1000, resp.body
+
+
+def runTasks(base_env, stop):
+    """Execute queued push tasks against main.app until stop is set and
+    the queue is empty."""
+    stub = apiproxy_stub_map.apiproxy.GetStub('taskqueue')
+    while True:
+        tasks = stub.get_filtered_tasks(queue_names=['default'])
+        for task in tasks:
+            stub.DeleteTask('default', task.name)
+            call({'app': 'main', 'path': task.url,
+                  'payload': task.payload or ''}, base_env)
+        if not tasks:
+            if stop.is_set():
+                return
+            time.sleep(0.1)
+
+
+def _percentile(values, percentile):
+    """Return percentile of sorted values (nearest rank)."""
+    if not values:
+        return None
+    return round(values[int(round(percentile / 100.0 *
+                                  (len(values) - 1)))], 3)
+
+
+def replay(entries, threads, base_env, pace=False, record=None):
+    """Run entries from threads workers; return list of (entry, status,
+    latency, body) in completion order and the wall time."""
+    work = Queue.Queue()
+    for entry in entries:
+        work.put(entry)
+    results, lock = [], threading.Lock()
+    start = time.time()
+
+    def worker():
+        while True:
+            try:
+                entry = work.get_nowait()
+            except Queue.Empty:
+                return
+            if pace and 't' in entry:
+                time.sleep(max(0, start + entry['t'] - time.time()))
+            offset = time.time() - start
+            status, latency, body = call(entry, base_env)
+            with lock:
+                results.append((dict(entry, t=round(offset, 3)),
+                                status, latency, body))
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    wall = time.time() - start
+    if record:
+        with open(record, 'w') as f:
+            for entry, _, _, _ in sorted(results, key=lambda r: r[0]['t']):
+                f.write(json.dumps(entry, sort_keys=True) + '\n')
+    return results, wall
+
+
+def checkAnomalies(hot, registered, churn_users):
+    """Return list of anomalies found in the datastore."""
+    anomalies = []
+    conf = ndb.Key(urlsafe=hot).get()
+    shards = [s for s in ndb.get_multi(seats.shardKeys(conf)) if s]
+    regs = Registration.query(Registration.conference == hot).count()
+    seats_left = sum(s.seatsAvailable for s in shards)
+    attendees = sum(s.attendees for s in shards)
+    if regs > conf.maxAttendees:
+        anomalies.append('oversell: %d registrations for %d seats' %
+                         (regs, conf.maxAttendees))
+    if seats_left + regs != conf.maxAttendees or attendees != regs:
+        anomalies.append('lost update: shards hold %d seats and %d '
+                         'attendees for %d registrations of %d seats' %
+                         (seats_left, attendees, regs, conf.maxAttendees))
+    if regs != registered:
+        anomalies.append('lost update: %d registrations stored, %d '
+                         'confirmed' % (regs, registered))
+    for user_id in churn_users:
+        prof = ndb.Key(Profile, user_id).get()
+        entries = WishlistEntry.query(ancestor=prof.key).fetch()
+        if set(prof.sessionKeysWishlist) != set(e.session for e in entries):
+            anomalies.append('lost update: wishlist of %s differs from '
+                             'its wishlist entries' % user_id)
+    return anomalies
+
+
+def summarize(results, wall):
+    """Return throughput, latency percentiles and status counts."""
+    by_path = {}
+    for entry, status, latency, body in results:
+        by_path.setdefault(entry['path'], []).append((status, latency))
+    summary = {'requests': len(results), 'seconds': round(wall, 3),
+               'throughput_rps': round(len(results) / wall, 1),
+               'paths': {}}
+    latencies = sorted(latency for _, _, latency, _ in results)
+    summary['p50_ms'] = _percentile(latencies, 50)
+    summary['p99_ms'] = _percentile(latencies, 99)
+    for path, calls in by_path.items():
+        path_latencies = sorted(latency for _, latency in calls)
+        statuses = {}
+        for status, _ in calls:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        summary['paths'][path] = {
+            'requests': len(calls), 'status': statuses,
+            'p50_ms': _percentile(path_latencies, 50),
+            'p99_ms': _percentile(path_latencies, 99)}
+    return summary
+
+
+def _registered(results, hot):
+    """Return number of confirmed registrations for conference hot."""
+    count = 0
+    for entry, status, _, body in results:
+        if entry['path'] == 'registerForConference' and status == 200 and \
+                (entry.get('body') or {}).get('websafeConferenceKey') == hot:
+            if json.loads(body).get('status') == 'REGISTERED':
+                count += 1
+    return count
+
+
+def loadTest():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--trace', help='JSONL trace to replay')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--capacity', type=int, default=50,
+                        help='seats of the contended conference')
+    parser.add_argument('--pace', action='store_true')
+    parser.add_argument('--record', help='write the executed trace here')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('-o', '--output', default='loadtest.json')
+    args = parser.parse_args()
+
+    bed = setUpStubs()
+    base_env = dict(os.environ)
+    request_environment.PatchOsEnviron()
+    request_environment.current_request.Init(None, base_env)
+    try:
+        data = dataset.seed(random_seed=args.seed)
+        hot = createHotConference(data.organizers[0], args.capacity)
+        if args.trace:
+            with open(args.trace) as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+        else:
+            entries = generateMix(data, hot, args.requests,
+                                  random.Random(args.seed))
+
+        counter = TransactionCounter()
+        stop = threading.Event()
+        tasks = threading.Thread(target=runTasks, args=(base_env, stop))
+        tasks.start()
+        results, wall = replay(entries, args.threads, base_env,
+                               args.pace, args.record)
+        stop.set()
+        tasks.join()
+
+        request_environment.current_request.Init(None, base_env)
+        report = summarize(results, wall)
+        report.update(counter.report())
+        report['anomalies'] = checkAnomalies(
+            hot, _registered(results, hot), data.users[:CHURN_USERS])
+    finally:
+        bed.deactivate()
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(json.dumps(dict((k, v) for k, v in report.items()
+                          if k != 'paths'), indent=2, sort_keys=True))
+    print('report written to %s' % args.output)
+    return 1 if report['anomalies'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(loadTest())
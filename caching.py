@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+
+"""
+caching.py -- memcache read-through caches for the conference API
+
+Rendered ConferenceForms are cached per conference. Every entry is
+stamped with the conference's version counter and, because a form
+includes the organizer's display name, the organizer's; both are read in
+the same memcache round trip before the form is loaded. Updating a
+conference bumps its counter, so a form loaded before the update and
+cached after it is never served; saving a profile bumps the organizer's
+counter and so invalidates all the conferences of that organizer at
+once. Version counters start at the current time in microseconds, so a
+counter seeded again after eviction never matches an older stamp.
+
+queryConferences results are cached per normalized filter list and page.
+Entries are stamped with a global catalog generation; any change to the
+conference catalog bumps it and so invalidates all of them in O(1).
+
+Profiles are cached in a short-lived in-instance LRU in front of
+memcache. Every profile write goes through setProfile/setProfiles (or
+invalidateProfiles where the entity is not at hand), so the memcache copy
+stays current; other instances may serve their local copy for at most
+PROFILE_LOCAL_TTL seconds. A miss fills memcache with add, and
+invalidation locks the key against adds for PROFILE_LOCK_TIME seconds,
+so a profile loaded before a concurrent write cannot replace it.
+
+Hot global values (announcement, featured speaker) are kept in an
+in-instance cache in front of memcache. Every write stamps the value
+with a new, unique version in memcache; after GLOBAL_LOCAL_TTL seconds
+an instance revalidates its copy by reading only the version stamp and
+refetches the value if the stamp changed.
+"""
+
+import collections
+import hashlib
+import threading
+import time
+import uuid
+
+from google.appengine.api import memcache
+from google.appengine.datastore import entity_pb
+from google.appengine.ext import ndb
+from protorpc import protobuf
+
+from models import ConferenceForm
+from models import ConferenceForms
+
+MEMCACHE_CONFERENCE_KEY = "CONFERENCE_FORM:%s"
+MEMCACHE_CONFERENCE_VERSION_KEY = "CONFERENCE_VERSION:%s"
+MEMCACHE_ORGANIZER_VERSION_KEY = "ORGANIZER_VERSION:%s"
+CONFERENCE_CACHE_TIME = 600     # seconds
+
+MEMCACHE_QUERY_KEY = "CONFERENCE_QUERY:%s"
+MEMCACHE_CATALOG_GENERATION_KEY = "CATALOG_GENERATION"
+MEMCACHE_QUERY_HITS_KEY = "CONFERENCE_QUERY_HITS"
+MEMCACHE_QUERY_MISSES_KEY = "CONFERENCE_QUERY_MISSES"
+QUERY_CACHE_TIME = 600          # seconds
+
+MEMCACHE_PROFILE_KEY = "PROFILE:%s"
+PROFILE_CACHE_TIME = 3600       # seconds
+PROFILE_LOCAL_TTL = 5           # seconds
+PROFILE_LOCAL_SIZE = 1000
+PROFILE_LOCK_TIME = 10          # seconds
+
+MEMCACHE_GLOBAL_VERSION_KEY = "GLOBAL_VERSION:%s"
+GLOBAL_LOCAL_TTL = 10           # seconds
+GLOBAL_LOCAL_SIZE = 100
+
+
+class LRUCache(object):
+    """LRUCache -- thread-safe in-instance cache with size limit and TTL"""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return cached value of key or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                return None
+            self._entries[key] = entry
+            return entry[1]
+
+    def getStale(self, key):
+        """Return cached value of key even if expired (None if missing)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[1] if entry is not None else None
+
+    def set(self, key, value, ttl=None):
+        """Cache value for key, evicting the least recently used entry."""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + (ttl or self.ttl), value)
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """Drop key from the cache."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Drop all entries."""
+        with self._lock:
+            self._entries.clear()
+
+
+_profiles = LRUCache(PROFILE_LOCAL_SIZE, PROFILE_LOCAL_TTL)
+_globals = LRUCache(GLOBAL_LOCAL_SIZE, GLOBAL_LOCAL_TTL)
+
+
+def _newVersion():
+    """Return the initial value of a version counter."""
+    return int(time.time() * 1000000)
+
+
+def _version(cached, version_key):
+    """Return version counter version_key from the get_multi result
+    cached, seeding the counter if it is missing."""
+    version = cached.get(version_key)
+    if version is None:
+        version = _newVersion()
+        if not memcache.add(version_key, version):
+            version = memcache.get(version_key) or version
+    return version
+
+
+def _bump(version_key):
+    """Increment version counter version_key, seeding it if missing."""
+    if memcache.incr(version_key) is None:
+        memcache.add(version_key, _newVersion())
+
+
+def getConferenceForm(wsck, loader):
+    """Return ConferenceForm of conference wsck from memcache; on a miss
+    call loader() and cache its result."""
+    organizer = ndb.Key(urlsafe=wsck).parent().id()
+    entry_key = MEMCACHE_CONFERENCE_KEY % wsck
+    version_keys = [MEMCACHE_ORGANIZER_VERSION_KEY % organizer,
+                    MEMCACHE_CONFERENCE_VERSION_KEY % wsck]
+
+    cached = memcache.get_multi([entry_key] + version_keys)
+    version = tuple(_version(cached, key) for key in version_keys)
+    entry = cached.get(entry_key)
+    if entry and entry[0] == version:
+        return protobuf.decode_message(ConferenceForm, entry[1])
+
+    form = loader()
+    memcache.set(entry_key, (version, protobuf.encode_message(form)),
+                 time=CONFERENCE_CACHE_TIME)
+    return form
+
+
+def invalidateConference(wsck):
+    """Drop the cached ConferenceForm of conference wsck; call after
+    the update committed."""
+    _bump(MEMCACHE_CONFERENCE_VERSION_KEY % wsck)
+    memcache.delete(MEMCACHE_CONFERENCE_KEY % wsck)
+
+
+def invalidateOrganizer(user_id):
+    """Invalidate the cached ConferenceForms of all conferences
+    organized by user_id (e.g. after a display name change)."""
+    _bump(MEMCACHE_ORGANIZER_VERSION_KEY % user_id)
+
+
+def _normalizeFilters(filters):
+    """Return canonical, sorted tuple of (field, operator, value) of
+    formatted filters (see ConferenceApi._formatFilters)."""
+    normalized = []
+    for filtr in filters:
+        value = filtr["value"]
+        if filtr["field"] in ("month", "maxAttendees"):
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                pass
+        normalized.append((filtr["field"], filtr["operator"], value))
+    return tuple(sorted(normalized))
+
+
+def _countQuery(counter_key):
+    """Count a query cache hit or miss without waiting for memcache."""
+    memcache.Client().offset_multi_async({counter_key: 1}, initial_value=0)
+
+
+def getConferenceQuery(filters, pageSize, cursor, loader,
+                       forms_cls=ConferenceForms, fieldMask=()):
+    """Return forms_cls message of a query page from memcache; on a miss
+    call loader() and cache its result for the current catalog."""
+    digest = hashlib.sha1(repr(
+        (forms_cls.__name__, _normalizeFilters(filters), pageSize,
+         cursor or '', tuple(sorted(set(fieldMask)))))).hexdigest()
+    entry_key = MEMCACHE_QUERY_KEY % digest
+
+    cached = memcache.get_multi([entry_key, MEMCACHE_CATALOG_GENERATION_KEY])
+    generation = _version(cached, MEMCACHE_CATALOG_GENERATION_KEY)
+    entry = cached.get(entry_key)
+    if entry and entry[0] == generation:
+        _countQuery(MEMCACHE_QUERY_HITS_KEY)
+        return protobuf.decode_message(forms_cls, entry[1])
+
+    _countQuery(MEMCACHE_QUERY_MISSES_KEY)
+    forms = loader()
+    memcache.set(entry_key, (generation, protobuf.encode_message(forms)),
+                 time=QUERY_CACHE_TIME)
+    return forms
+
+
+def invalidateCatalog():
+    """Invalidate all cached conference query results."""
+    _bump(MEMCACHE_CATALOG_GENERATION_KEY)
+
+
+def queryCacheStats():
+    """Return (hits, misses, generation) of the conference query cache."""
+    stats = memcache.get_multi([MEMCACHE_QUERY_HITS_KEY,
+                                MEMCACHE_QUERY_MISSES_KEY,
+                                MEMCACHE_CATALOG_GENERATION_KEY])
+    return (stats.get(MEMCACHE_QUERY_HITS_KEY, 0),
+            stats.get(MEMCACHE_QUERY_MISSES_KEY, 0),
+            stats.get(MEMCACHE_CATALOG_GENERATION_KEY, 0))
+
+
+def _encodeEntity(entity):
+    """Return serialized entity; cached entities are decoded into a
+    fresh copy on every read, so callers may modify them."""
+    return ndb.model_to_protobuf(entity).Encode()
+
+
+def _decodeEntity(data):
+    """Return entity from its serialized form."""
+    return ndb.model_from_protobuf(entity_pb.EntityProto(data))
+
+
+def getProfile(user_id, loader):
+    """Return Profile of user_id from the instance cache or memcache;
+    on a miss call loader() and cache its result."""
+    data = _profiles.get(user_id)
+    if data is None:
+        data = memcache.get(MEMCACHE_PROFILE_KEY % user_id)
+        if data is None:
+            # a write committed since the load has set (or locked) the
+            # key, so add fails rather than overwrite it
+            prof = loader()
+            data = _encodeEntity(prof)
+            if memcache.add(MEMCACHE_PROFILE_KEY % user_id, data,
+                            time=PROFILE_CACHE_TIME):
+                _profiles.set(user_id, data)
+            return prof
+        _profiles.set(user_id, data)
+    return _decodeEntity(data)
+
+
+def setProfile(prof):
+    """Write prof through to both cache tiers and return it."""
+    data = _encodeEntity(prof)
+    _profiles.set(prof.key.id(), data)
+    memcache.set(MEMCACHE_PROFILE_KEY % prof.key.id(), data,
+                 time=PROFILE_CACHE_TIME)
+    return prof
+
+
+def setProfiles(profiles):
+    """Write several profiles through to both cache tiers."""
+    mapping = {}
+    for prof in profiles:
+        data = _encodeEntity(prof)
+        _profiles.set(prof.key.id(), data)
+        mapping[MEMCACHE_PROFILE_KEY % prof.key.id()] = data
+    if mapping:
+        memcache.set_multi(mapping, time=PROFILE_CACHE_TIME)
+
+
+def invalidateProfiles(user_ids):
+    """Drop the cached profiles of user_ids."""
+    for user_id in user_ids:
+        _profiles.delete(user_id)
+    if user_ids:
+        memcache.delete_multi(
+            [MEMCACHE_PROFILE_KEY % user_id for user_id in user_ids],
+            seconds=PROFILE_LOCK_TIME)
+
+
+def getGlobal(key):
+    """Return value of global memcache key (None if not set), served
+    from the instance cache while its version stamp is current."""
+    entry = _globals.get(key)
+    if entry is not None:
+        return entry[1]
+
+    # expired local copy: revalidate it with the version stamp alone
+    version_key = MEMCACHE_GLOBAL_VERSION_KEY % key
+    stale = _globals.getStale(key)
+    if stale is not None and memcache.get(version_key) == stale[0]:
+        _globals.set(key, stale)
+        return stale[1]
+
+    cached = memcache.get_multi([key, version_key])
+    version = cached.get(version_key)
+    if version is None:
+        # stamp evicted or never written; a new unique stamp can never
+        # match a stale local copy
+        version = uuid.uuid4().hex
+        if not memcache.add(version_key, version):
+            version = memcache.get(version_key) or version
+    _globals.set(key, (version, cached.get(key)))
+    return cached.get(key)
+
+
+def touchGlobal(key):
+    """Stamp global key with a new version after its value was written
+    (or deleted) in memcache, so instances drop their local copies."""
+    memcache.set(MEMCACHE_GLOBAL_VERSION_KEY % key, uuid.uuid4().hex)
+    _globals.delete(key)
+
+
+def setGlobal(key, value):
+    """Write global key through to memcache and stamp a new version."""
+    memcache.set(key, value)
+    touchGlobal(key)
+
+
+def deleteGlobal(key):
+    """Delete global key from memcache and stamp a new version."""
+    memcache.delete(key)
+    touchGlobal(key)
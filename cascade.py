@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+"""
+cascade.py -- chunked cleanup of references to deleted entities
+
+Deleting an entity that is referenced from many others would take one
+serial put per referencing entity. Instead the references are cleared
+in chunks of CASCADE_CHUNK entities, with put_multi (sessions) or one
+transaction per entity run in parallel (profiles, which registrations
+and wishlist changes update concurrently); the first chunk is processed
+in the request, further chunks by tasks chained with a query cursor.
+
+Speaker deletion runs entirely in tasks; its progress is recorded in a
+CascadeJob entity which clients can poll.
+"""
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import CascadeJob
+from models import Session
+
+import caching
+import wishlists
+
+CASCADE_CHUNK = 100
+
+
+def _startCursor(websafeCursor):
+    """Return Cursor from websafe cursor string (if any)."""
+    return ndb.Cursor(urlsafe=websafeCursor) if websafeCursor else None
+
+
+@ndb.transactional_tasklet
+def _removeFromWishlist(p_key, wssk):
+    """Remove session wssk from the wishlist of the stored Profile."""
+    prof = yield p_key.get_async()
+    if prof and wssk in prof.sessionKeysWishlist:
+        prof.sessionKeysWishlist.remove(wssk)
+        yield prof.put_async()
+    raise ndb.Return(prof)
+
+
+def removeSessionFromWishlists(wssk, websafeCursor=None):
+    """Remove session wssk from one chunk of wishlists; return the
+    websafe cursor of the next chunk or None when done."""
+    entry_keys, cursor, more = wishlists.entriesQuery(wssk).fetch_page(
+        CASCADE_CHUNK, keys_only=True,
+        start_cursor=_startCursor(websafeCursor))
+    futures = [_removeFromWishlist(key.parent(), wssk)
+               for key in entry_keys]
+    profiles = [prof for prof in (f.get_result() for f in futures) if prof]
+    ndb.delete_multi(entry_keys)
+    caching.setProfiles(profiles)
+    return cursor.urlsafe() if more and cursor else None
+
+
+def deleteSession(wssk, websafeCursor=None):
+    """Remove deleted session wssk from the wishlists, one chunk now,
+    the remaining ones in chained tasks."""
+    cursor = removeSessionFromWishlists(wssk, websafeCursor)
+    if cursor:
+        taskqueue.add(params={'websafeSessionKey': wssk, 'cursor': cursor},
+                      url='/tasks/cascade_session_delete')
+
+
+def clearSpeakerFromSessions(wsspk, websafeCursor=None):
+    """Clear speaker wsspk from one chunk of sessions; return number of
+    sessions updated and the websafe cursor of the next chunk (or None)."""
+    session_keys, cursor, more = Session.query(
+        Session.speaker == wsspk).fetch_page(
+            CASCADE_CHUNK, keys_only=True,
+            start_cursor=_startCursor(websafeCursor))
+    sessions = [session for session in ndb.get_multi(session_keys)
+                if session and session.speaker == wsspk]
+    for session in sessions:
+        session.speaker = ''
+    ndb.put_multi(sessions)
+    return len(sessions), (cursor.urlsafe() if more and cursor else None)
+
+
+def deleteSpeaker(wsspk):
+    """Start the background removal of speaker wsspk from its sessions;
+    return the CascadeJob tracking it."""
+    job = CascadeJob(target=wsspk)
+    job.put()
+    taskqueue.add(params={'job': job.key.urlsafe()},
+                  url='/tasks/cascade_speaker_delete')
+    return job
+
+
+def _pending(job, websafeCursor):
+    """Return True if the chunk at websafeCursor is the next one of job."""
+    return job and job.status != 'DONE' and \
+        (job.cursor or '') == (websafeCursor or '')
+
+
+@ndb.transactional()
+def _advanceJob(websafeJobKey, websafeCursor, count, cursor):
+    """Count the chunk at websafeCursor and chain the task for the next
+    one, once: a retried task finds the job advanced past its chunk."""
+    job = ndb.Key(urlsafe=websafeJobKey).get()
+    if not _pending(job, websafeCursor):
+        return
+    job.processed += count
+    if cursor:
+        job.cursor = cursor
+        taskqueue.add(params={'job': websafeJobKey, 'cursor': cursor},
+                      url='/tasks/cascade_speaker_delete', transactional=True)
+    else:
+        job.status = 'DONE'
+    job.put()
+
+
+def continueSpeakerDelete(websafeJobKey, websafeCursor=None):
+    """Process the next chunk of a speaker deletion job; clearing the
+    speaker again is harmless, so only the job update is guarded."""
+    job = ndb.Key(urlsafe=websafeJobKey).get()
+    if not _pending(job, websafeCursor):
+        return
+    count, cursor = clearSpeakerFromSessions(job.target, websafeCursor)
+    _advanceJob(websafeJobKey, websafeCursor, count, cursor)
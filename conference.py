@@ -19,9 +19,10 @@ from protorpc import messages
 from protorpc import message_types
 from protorpc import remote
 
-from google.appengine.api import memcache
 from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
+from google.appengine.api import datastore_errors
+from google.appengine.datastore.datastore_query import Cursor
 
 from models import ConflictException
 from models import Profile
@@ -30,20 +31,30 @@ from models import ProfileForm
 from models import ProfileForms
 from models import StringMessage
 from models import BooleanMessage
+from models import IntegerMessage
 from models import Conference
 from models import ConferenceForm
 from models import ConferenceForms
+from models import ConferenceListForms
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
+from models import QueryCacheStatsForm
 from models import TeeShirtSize
+from models import RegistrationStatus
+from models import RegistrationStatusForm
 
 from models import SessionType
 from models import Session
 from models import SessionForm
 from models import SessionForms
+from models import SessionQueryForms
 from models import Speaker
 from models import SpeakerForm
 from models import SpeakerForms
+from models import FeaturedSpeakerForm
+from models import FeaturedSpeakerForms
+from models import CascadeStatus
+from models import CascadeStatusForm
 
 from settings import WEB_CLIENT_ID
 from settings import ANDROID_CLIENT_ID
@@ -52,13 +63,28 @@ from settings import ANDROID_AUDIENCE
 
 from utils import getUserId
 
+from serializers import attendeeSerializer
+from serializers import conferenceListSerializer
+from serializers import conferenceSerializer
+from serializers import maskProjection
+from serializers import profileSerializer
+from serializers import sessionSerializer
+from serializers import speakerSerializer
+
+import admission
+import announcements
+import caching
+import cascade
+import conferencequery
+import instrumentation
+import registrations
+import seats
+import sessionquery
+import speakers
+import wishlists
+
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
-MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
-MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED SPEAKER"
-ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
-                    'are nearly sold out: %s')
-FEATURED_SPEAKER_TPL = ('Speaker %s features in the following sessions: %s')
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -67,6 +93,7 @@ DEFAULTS = {
     "maxAttendees": 0,
     "seatsAvailable": 0,
     "topics": ["Default", "Topic"],
+    "hot": False,
 }
 
 OPERATORS = {
@@ -78,6 +105,13 @@ OPERATORS = {
             'NE':   '!='
             }
 
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+MAX_BATCH_SIZE = 500
+# a cross-group transaction spans at most 25 entity groups: the
+# conference of the sessions plus the groups of their speakers
+MAX_TXN_SPEAKERS = 24
+
 FIELDS = {
             'CITY': 'city',
             'TOPIC': 'topics',
@@ -100,10 +134,29 @@ SESSION_POST_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+# list endpoints take an optional field mask ("fieldMask", since
+# "fields" is reserved for the partial responses of the API frontend)
+LIST_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    fieldMask=messages.StringField(1, repeated=True),
+)
+
+SESSIONS_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    fieldMask=messages.StringField(2, repeated=True),
+)
+
+SESSIONS_POST_REQUEST = endpoints.ResourceContainer(
+    SessionForms,
+    websafeConferenceKey=messages.StringField(1),
+)
+
 SESSION_TYPE_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
     sessionType=messages.StringField(2),
+    fieldMask=messages.StringField(3, repeated=True),
 )
 
 SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
@@ -111,6 +164,42 @@ SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
     websafeSpeakerKey=messages.StringField(1),
 )
 
+ATTENDEES_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    cursor=messages.StringField(3),
+    fieldMask=messages.StringField(4, repeated=True),
+)
+
+TICKET_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    ticket=messages.StringField(1),
+)
+
+FEATURED_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1, repeated=True),
+)
+
+JOB_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    job=messages.StringField(1),
+)
+
+SPEAKER_SESSIONS_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeSpeakerKey=messages.StringField(1),
+    summary=messages.BooleanField(2),
+    fieldMask=messages.StringField(3, repeated=True),
+)
+
+WISHLISTERS_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeSessionKey=messages.StringField(1),
+    fieldMask=messages.StringField(2, repeated=True),
+)
+
 SESSION_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeSessionKey=messages.StringField(1),
@@ -123,27 +212,16 @@ SESSION_GET_REQUEST = endpoints.ResourceContainer(
                allowed_client_ids=[WEB_CLIENT_ID, API_EXPLORER_CLIENT_ID,
                                    ANDROID_CLIENT_ID, IOS_CLIENT_ID],
                scopes=[EMAIL_SCOPE])
+@instrumentation.instrumented
 class ConferenceApi(remote.Service):
     """Conference API v0.1"""
 
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
-    def _copyConferenceToForm(self, conf, displayName):
+    def _copyConferenceToForm(self, conf, displayName,
+                              serializer=conferenceSerializer):
         """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
-        if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
-        return cf
+        return serializer.toForm(conf, organizerDisplayName=displayName)
 
     def _createConferenceObject(self, request):
         """Create or update Conference object,
@@ -194,16 +272,19 @@ class ConferenceApi(remote.Service):
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
 
-        # create Conference, send email to organizer confirming
-        # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
+        # create Conference with its seat shards, send email to organizer
+        # confirming creation of Conference & return (modified) ConferenceForm
+        conf = Conference(**data)
+        ndb.put_multi([conf] + seats.createShards(conf))
+        announcements.update(conf)
+        caching.invalidateCatalog()
         taskqueue.add(params={'email': user.email(),
                       'conferenceInfo': repr(request)},
                       url='/tasks/send_confirmation_email')
         return request
 
 
-    @ndb.transactional()
+    @ndb.transactional(xg=True)
     def _updateConferenceObject(self, request):
         user = endpoints.get_current_user()
         if not user:
@@ -229,6 +310,7 @@ class ConferenceApi(remote.Service):
 
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
+        old_seats, old_name = conf.seatsAvailable, conf.name
         for field in request.all_fields():
             data = getattr(request, field.name)
             # only copy fields where we get data
@@ -240,7 +322,14 @@ class ConferenceApi(remote.Service):
                         conf.month = data.month
                 # write to Conference object
                 setattr(conf, field.name, data)
+
+        # seats are counted in the seat shards; move the difference
+        # to the requested number of available seats there
+        if request.seatsAvailable is not None and conf.seatShards:
+            conf.seatsAvailable = seats.adjustSeats(
+                conf, request.seatsAvailable - seats.seatsAvailable(conf))
         conf.put()
+        announcements.update(conf, old_seats, old_name)
         prof = ndb.Key(Profile, user_id).get()
         return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
 
@@ -257,7 +346,11 @@ class ConferenceApi(remote.Service):
                       http_method='PUT', name='updateConference')
     def updateConference(self, request):
         """Update conference w/provided fields & return w/updated info."""
-        return self._updateConferenceObject(request)
+        cf = self._updateConferenceObject(request)
+        # invalidate only after the update transaction has committed
+        caching.invalidateConference(request.websafeConferenceKey)
+        caching.invalidateCatalog()
+        return cf
 
 
     @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
@@ -265,18 +358,26 @@ class ConferenceApi(remote.Service):
                       http_method='GET', name='getConference')
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
-        # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        return caching.getConferenceForm(
+            request.websafeConferenceKey,
+            lambda: self._loadConferenceForm(request.websafeConferenceKey))
+
+
+    def _loadConferenceForm(self, wsck):
+        """Return ConferenceForm of conference wsck from datastore."""
+        # get Conference object from request together with its parent,
+        # the organizer's Profile, in one batch (1 RPC instead of 2
+        # sequential ones); bail if not found
+        conf_key = ndb.Key(urlsafe=wsck)
+        conf, prof = ndb.get_multi([conf_key, conf_key.parent()])
         if not conf:
             raise endpoints.NotFoundException(
-                'No conference found with key: %s' %
-                request.websafeConferenceKey)
-        prof = conf.key.parent().get()
+                'No conference found with key: %s' % wsck)
         # return ConferenceForm
         return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
 
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(LIST_GET_REQUEST, ConferenceForms,
                       path='getConferencesCreated',
                       http_method='POST', name='getConferencesCreated')
     def getConferencesCreated(self, request):
@@ -286,36 +387,48 @@ class ConferenceApi(remote.Service):
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
         user_id = getUserId(user)
+        serializer = self._maskedSerializer(
+            conferenceSerializer, request.fieldMask)
 
-        # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
+        # run the ancestor query for all key matches for this user and
+        # get the user's profile concurrently (2 RPCs, 1 round trip)
+        p_key = ndb.Key(Profile, user_id)
+        confs = Conference.query(ancestor=p_key).fetch_async()
+        prof = p_key.get_async()
+        displayName = getattr(prof.get_result(), 'displayName')
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(
-            items=[self._copyConferenceToForm(
-                conf, getattr(prof, 'displayName')) for conf in confs]
+            items=[self._copyConferenceToForm(conf, displayName, serializer)
+                   for conf in confs.get_result()]
         )
 
 
+    @endpoints.method(message_types.VoidMessage, ConferenceListForms,
+                      path='getConferencesCreatedList',
+                      http_method='POST', name='getConferencesCreatedList')
+    def getConferencesCreatedList(self, request):
+        """Return compact list entries of conferences created by user."""
+        # make sure user is authed
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+
+        # projected ancestor query for all key matches for this user
+        confs = Conference.query(ancestor=ndb.Key(Profile, user_id)).fetch(
+            projection=conferencequery.LIST_PROJECTION)
+        return self._conferenceListForms(confs)
+
+
     def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Conference.query()
+        """Return query plan from the submitted filters; filters no index
+        in index.yaml can serve are evaluated in memory."""
         inequality_filter, filters = self._formatFilters(request.filters)
 
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Conference.name)
-        else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Conference.name)
-
         for filtr in filters:
             if filtr["field"] in ["month", "maxAttendees"]:
                 filtr["value"] = int(filtr["value"])
-            formatted_query = ndb.query.FilterNode(
-                filtr["field"], filtr["operator"], filtr["value"])
-            q = q.filter(formatted_query)
-        return q
+        return conferencequery.plan(filters)
 
 
     def _formatFilters(self, filters):
@@ -355,62 +468,202 @@ class ConferenceApi(remote.Service):
                       http_method='POST',
                       name='queryConferences')
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
+        """Query for conferences, one page at a time."""
+        # identical searches (after normalizing the filters) are
+        # served from memcache until the conference catalog changes
+        inequality_filter, filters = self._formatFilters(request.filters)
+        serializer = self._maskedSerializer(
+            conferenceSerializer, request.fieldMask)
+        return caching.getConferenceQuery(
+            filters, self._pageSize(request.pageSize), request.cursor,
+            lambda: self._queryConferences(request, serializer),
+            fieldMask=request.fieldMask)
+
+
+    def _queryConferences(self, request, serializer=conferenceSerializer):
+        """Return ConferenceForms with one page of query results."""
+        # fetch a single page of results; the query is executed only once
+        # and the cursor of its last entity is handed back to the client
+        confs, next_cursor, more = self._getQuery(request).fetch_page(
+            self._pageSize(request.pageSize),
+            start_cursor=self._startCursor(request.cursor))
 
         # need to fetch organiser displayName from profiles
         # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId))
-                      for conf in conferences]
-        profiles = ndb.get_multi(organisers)
+        organisers = set(ndb.Key(Profile, conf.organizerUserId)
+                         for conf in confs)
+        profiles = ndb.get_multi(list(organisers))
 
         # put display names in a dict for easier fetching
         names = {}
         for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+            if profile:
+                names[profile.key.id()] = profile.displayName
 
         # return individual ConferenceForm object per Conference
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf,
-                   names[conf.organizerUserId]) for conf in conferences]
+            items=[self._copyConferenceToForm(
+                conf, names.get(conf.organizerUserId), serializer)
+                for conf in confs],
+            nextPageToken=(next_cursor.urlsafe()
+                           if more and next_cursor else None)
         )
 
 
-    @endpoints.method(CONF_GET_REQUEST, ProfileForms,
+    @endpoints.method(ConferenceQueryForms, ConferenceListForms,
+                      path='queryConferencesList',
+                      http_method='POST',
+                      name='queryConferencesList')
+    def queryConferencesList(self, request):
+        """Query for conferences, returning compact list entries."""
+        inequality_filter, filters = self._formatFilters(request.filters)
+        serializer = self._maskedSerializer(
+            conferenceListSerializer, request.fieldMask)
+        return caching.getConferenceQuery(
+            filters, self._pageSize(request.pageSize), request.cursor,
+            lambda: self._queryConferencesList(request, serializer),
+            forms_cls=ConferenceListForms, fieldMask=request.fieldMask)
+
+
+    def _queryConferencesList(self, request,
+                              serializer=conferenceListSerializer):
+        """Return ConferenceListForms with one page of query results,
+        projecting the list fields where an index allows it."""
+        plan = self._getQuery(request)
+        projection = plan.projection(conferencequery.LIST_PROJECTION)
+        confs, next_cursor, more = plan.fetch_page(
+            self._pageSize(request.pageSize),
+            start_cursor=self._startCursor(request.cursor),
+            projection=projection)
+        return self._conferenceListForms(
+            confs, next_cursor if more else None,
+            plan.knownValues() if projection else {}, serializer)
+
+
+    def _conferenceListForms(self, confs, next_cursor=None, known=None,
+                             serializer=conferenceListSerializer):
+        """Return ConferenceListForms of (possibly projected) conferences,
+        joining the organizers' display names."""
+        known = known or {}
+        organizers = set(ndb.Key(Profile, known.get(
+            'organizerUserId', conf.organizerUserId)) for conf in confs)
+        names = dict((prof.key.id(), prof.displayName)
+                     for prof in ndb.get_multi(list(organizers)) if prof)
+        items = []
+        for conf in confs:
+            values = dict(known)
+            if 'startDate' in values:
+                values['startDate'] = str(values['startDate'])
+            values['organizerDisplayName'] = names.get(
+                values.pop('organizerUserId', conf.organizerUserId))
+            # equality filters may fix fields the list form does not have
+            values = dict((name, value) for name, value in values.items()
+                          if name in conferenceListSerializer.fieldNames)
+            items.append(serializer.toForm(conf, **values))
+        return ConferenceListForms(
+            items=items,
+            nextPageToken=next_cursor.urlsafe() if next_cursor else None)
+
+
+    @endpoints.method(message_types.VoidMessage, QueryCacheStatsForm,
+                      path='queryConferences/cacheStats',
+                      http_method='GET', name='getQueryCacheStats')
+    def getQueryCacheStats(self, request):
+        """Return hit and miss counts of the queryConferences cache."""
+        hits, misses, generation = caching.queryCacheStats()
+        return QueryCacheStatsForm(
+            hits=hits, misses=misses, generation=generation)
+
+
+    @staticmethod
+    def _pageSize(pageSize):
+        """Return requested page size, bounded to MAX_PAGE_SIZE."""
+        if not pageSize or pageSize < 0:
+            return DEFAULT_PAGE_SIZE
+        return min(pageSize, MAX_PAGE_SIZE)
+
+
+    @staticmethod
+    def _startCursor(websafeCursor):
+        """Return datastore Cursor from websafe cursor string (if any)."""
+        if not websafeCursor:
+            return None
+        try:
+            return Cursor(urlsafe=websafeCursor)
+        except datastore_errors.BadValueError:
+            raise endpoints.BadRequestException(
+                'Invalid page token: %s' % websafeCursor)
+
+
+    @staticmethod
+    def _maskedSerializer(serializer, fieldMask):
+        """Return serializer restricted to the fields of fieldMask
+        (all fields if the mask is empty)."""
+        unknown = set(fieldMask) - serializer.fieldNames
+        if unknown:
+            raise endpoints.BadRequestException(
+                'Unknown fields in field mask: %s' %
+                ', '.join(sorted(unknown)))
+        return serializer.masked(fieldMask)
+
+
+    @staticmethod
+    def _fetchMasked(query, serializer, projection=None):
+        """Return forms of the results of query for a masked serializer,
+        fetching keys only or projected entities where possible."""
+        if serializer.keysOnly():
+            return serializer.fromKeys(query.fetch(keys_only=True))
+        return serializer.toForms(query.fetch(projection=projection))
+
+
+    @endpoints.method(ATTENDEES_GET_REQUEST, ProfileForms,
                       path='getConferenceAttendees',
                       http_method='GET',
                       name='getConferenceAttendees')
     def getConferenceAttendees(self, request):
-        """Query for users attending the specified conference."""
+        """Query for users attending the specified conference,
+        one page at a time."""
+
+        serializer = self._maskedSerializer(
+            attendeeSerializer, request.fieldMask)
 
-        # find all profiles containing the conference key
-        # in their conferences to attend
-        profiles = Profile.query(
-            Profile.conferenceKeysToAttend == request.websafeConferenceKey)
+        # find the registrations of the conference, projecting only the
+        # profile fields copied to them (the registration index serves
+        # this projection only, so a field mask just skips conversions)
+        regs, next_cursor, more = registrations.attendeesQuery(
+            request.websafeConferenceKey).fetch_page(
+                self._pageSize(request.pageSize),
+                start_cursor=self._startCursor(request.cursor),
+                projection=registrations.ATTENDEE_PROJECTION)
 
         # return profiles of conference attendees
         return ProfileForms(
-            profiles=[self._copyProfileToForm(profile) for profile in profiles]
+            profiles=serializer.toForms(regs),
+            nextPageToken=(next_cursor.urlsafe()
+                           if more and next_cursor else None)
         )
 
 
+    @endpoints.method(CONF_GET_REQUEST, IntegerMessage,
+                      path='getConferenceAttendeeCount',
+                      http_method='GET',
+                      name='getConferenceAttendeeCount')
+    def getConferenceAttendeeCount(self, request):
+        """Return number of users attending the specified conference."""
+        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' %
+                request.websafeConferenceKey)
+        return IntegerMessage(data=seats.attendeeCount(conf))
+
+
 
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
 
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
-        # copy relevant fields from Profile to ProfileForm
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name,
-                            getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
-        return pf
+        return profileSerializer.toForm(prof)
 
 
     def _getProfileFromUser(self):
@@ -421,8 +674,15 @@ class ConferenceApi(remote.Service):
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
 
-        # get Profile from datastore
+        # get Profile from profile cache, falling back to datastore
         user_id = getUserId(user)
+        return caching.getProfile(
+            user_id, lambda: self._loadProfile(user, user_id))
+
+
+    def _loadProfile(self, user, user_id):
+        """Return user Profile from datastore,
+        creating new one if non-existent."""
         p_key = ndb.Key(Profile, user_id)
         profile = p_key.get()
         # create new Profile if not there
@@ -445,21 +705,35 @@ class ConferenceApi(remote.Service):
 
         # if saveProfile(), process user-modifyable fields
         if save_request:
-            for field in ('displayName', 'teeShirtSize'):
-                if hasattr(save_request, field):
-                    val = getattr(save_request, field)
-                    if val:
-                        setattr(prof, field, str(val))
-                        # if field == 'teeShirtSize':
-                        #    setattr(prof, field, str(val).upper())
-                        # else:
-                        #    setattr(prof, field, val)
-                        prof.put()
+            prof = caching.setProfile(
+                self._saveProfileFields(prof.key, save_request))
+            registrations.updateProfile(prof)
+            # display name is part of the cached conferences of the user
+            caching.invalidateOrganizer(prof.key.id())
+            caching.invalidateCatalog()
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
 
 
+    @ndb.transactional()
+    def _saveProfileFields(self, p_key, save_request):
+        """Copy the user-modifyable fields to the stored Profile; the
+        cached Profile may be slightly stale."""
+        prof = p_key.get()
+        for field in ('displayName', 'teeShirtSize'):
+            if hasattr(save_request, field):
+                val = getattr(save_request, field)
+                if val:
+                    setattr(prof, field, str(val))
+                    # if field == 'teeShirtSize':
+                    #    setattr(prof, field, str(val).upper())
+                    # else:
+                    #    setattr(prof, field, val)
+        prof.put()
+        return prof
+
+
     @endpoints.method(message_types.VoidMessage, ProfileForm,
                       path='profile', http_method='GET', name='getProfile')
     def getProfile(self, request):
@@ -479,27 +753,11 @@ class ConferenceApi(remote.Service):
 
     @staticmethod
     def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
+        """Reconcile the nearly sold out conferences & assign the
+        announcement to memcache; used by memcache cron job. Seat
+        changes maintain the announcement in between.
         """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
-
-        if confs:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = ANNOUNCEMENT_TPL % (
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
-
-        return announcement
+        return announcements.reconcile()
 
 
     @endpoints.method(message_types.VoidMessage, StringMessage,
@@ -508,16 +766,15 @@ class ConferenceApi(remote.Service):
     def getAnnouncement(self, request):
         """Return Announcement from memcache."""
         return StringMessage(
-            data=memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or "")
+            data=caching.getGlobal(
+                announcements.MEMCACHE_ANNOUNCEMENTS_KEY) or "")
 
 
 
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
-    @ndb.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
-        retval = None
         # get user Profile
         prof = self._getProfileFromUser()
 
@@ -529,6 +786,60 @@ class ConferenceApi(remote.Service):
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
 
+        # hot conferences: queue the request and hand out a pending ticket
+        if reg and conf.hot:
+            if wsck in prof.conferenceKeysToAttend:
+                raise ConflictException(
+                    "You have already registered for this conference")
+            return self._copyTicketToForm(admission.enqueue(prof.key, wsck))
+
+        conf = seats.ensureShards(conf)
+
+        # register: take a seat from one of the shards which still
+        # have seats, trying the next one if it ran empty meanwhile
+        if reg:
+            for shard_key in seats.candidateShards(conf):
+                retval = self._registrationTransaction(
+                    prof.key, wsck, shard_key, reg)
+                if retval is not None:
+                    break
+            else:
+                raise ConflictException(
+                    "There are no seats available.")
+
+        # unregister: give the seat back to any shard
+        else:
+            retval = self._registrationTransaction(
+                prof.key, wsck, seats.randomShard(conf), reg)
+
+        # refresh Conference.seatsAvailable from the shards
+        if retval:
+            seats.scheduleReconcile(wsck)
+            caching.invalidateProfiles([prof.key.id()])
+        if reg:
+            return RegistrationStatusForm(
+                data=retval, status=RegistrationStatus.REGISTERED)
+        return BooleanMessage(data=retval)
+
+
+    def _copyTicketToForm(self, ticket):
+        """Copy relevant fields from RegistrationTicket to
+        RegistrationStatusForm."""
+        rf = RegistrationStatusForm(
+            data=ticket.status == 'REGISTERED',
+            status=getattr(RegistrationStatus, ticket.status),
+            ticket=ticket.key.urlsafe(),
+            reason=ticket.reason)
+        rf.check_initialized()
+        return rf
+
+
+    @ndb.transactional(xg=True)
+    def _registrationTransaction(self, p_key, wsck, shard_key, reg):
+        """Update Profile and one seat shard for (un)registration;
+        return None if the shard has no seat left."""
+        prof, shard = ndb.get_multi([p_key, shard_key])
+
         # register
         if reg:
             # check if user already registered otherwise add
@@ -536,71 +847,108 @@ class ConferenceApi(remote.Service):
                 raise ConflictException(
                     "You have already registered for this conference")
 
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
-                raise ConflictException(
-                    "There are no seats available.")
+            # check if seats avail in this shard
+            if shard.seatsAvailable <= 0:
+                return None
 
             # register user, take away one seat
             prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
-            retval = True
+            shard.seatsAvailable -= 1
+            shard.attendees += 1
+            registrations.newRegistration(prof, wsck).put()
 
         # unregister
         else:
             # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
+            if wsck not in prof.conferenceKeysToAttend:
+                return False
 
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
-            else:
-                retval = False
+            # unregister user, add back one seat
+            prof.conferenceKeysToAttend.remove(wsck)
+            shard.seatsAvailable += 1
+            shard.attendees -= 1
+            registrations.registrationKey(prof.key, wsck).delete()
 
         # write things back to the datastore & return
-        prof.put()
-        conf.put()
-        return BooleanMessage(data=retval)
+        ndb.put_multi([prof, shard])
+        return True
 
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(LIST_GET_REQUEST, ConferenceForms,
                       path='conferences/attending',
                       http_method='GET', name='getConferencesToAttend')
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
-        # get user Profile
+        serializer = self._maskedSerializer(
+            conferenceSerializer, request.fieldMask)
+        # get user Profile (cached, so usually no RPC)
         prof = self._getProfileFromUser()
         conf_keys = [ndb.Key(urlsafe=wsck)
                      for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
-
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId)
-                      for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
 
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(
-            items=[self._copyConferenceToForm(
-                    conf, names[conf.organizerUserId])
-                   for conf in conferences]
+            items=self._conferenceFormsAsync(
+                conf_keys, serializer).get_result()
         )
 
 
-    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+    @ndb.tasklet
+    def _conferenceFormsAsync(self, conf_keys,
+                              serializer=conferenceSerializer):
+        """Return ConferenceForms of the conferences conf_keys (skipping
+        deleted ones). The organizers' profiles are the parents of the
+        conference keys, so conferences and organizers are fetched in
+        one batch (1 RPC instead of 2 sequential ones)."""
+        organizer_keys = list(set(key.parent() for key in conf_keys))
+        entities = yield ndb.get_multi_async(conf_keys + organizer_keys)
+        conferences = entities[:len(conf_keys)]
+        names = dict((prof.key.id(), prof.displayName)
+                     for prof in entities[len(conf_keys):] if prof)
+        raise ndb.Return([
+            self._copyConferenceToForm(
+                conf, names.get(conf.organizerUserId), serializer)
+            for conf in conferences if conf])
+
+
+    @endpoints.method(message_types.VoidMessage, ConferenceListForms,
+                      path='conferences/attending/list',
+                      http_method='GET', name='getConferencesToAttendList')
+    def getConferencesToAttendList(self, request):
+        """Get compact list entries of conferences user registered for."""
+        # conferences are looked up by key, so they cannot be projected
+        prof = self._getProfileFromUser()
+        conferences = ndb.get_multi([ndb.Key(urlsafe=wsck)
+                                     for wsck in prof.conferenceKeysToAttend])
+        return self._conferenceListForms(
+            [conf for conf in conferences if conf])
+
+
+    @endpoints.method(CONF_GET_REQUEST, RegistrationStatusForm,
                       path='conference/{websafeConferenceKey}',
                       http_method='POST', name='registerForConference')
     def registerForConference(self, request):
-        """Register user for selected conference."""
+        """Register user for selected conference; registrations for hot
+        conferences are queued and return a pending ticket."""
         return self._conferenceRegistration(request)
 
 
+    @endpoints.method(TICKET_GET_REQUEST, RegistrationStatusForm,
+                      path='registration/{ticket}',
+                      http_method='GET', name='getRegistrationStatus')
+    def getRegistrationStatus(self, request):
+        """Return status of a queued registration ticket."""
+        prof = self._getProfileFromUser()
+
+        # tickets are children of their user's Profile
+        t_key = ndb.Key(urlsafe=request.ticket)
+        ticket = t_key.get() if t_key.parent() == prof.key else None
+        if not ticket:
+            raise endpoints.NotFoundException(
+                'No registration ticket found: %s' % request.ticket)
+        return self._copyTicketToForm(ticket)
+
+
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
                       path='conference/{websafeConferenceKey}',
                       http_method='DELETE', name='unregisterFromConference')
@@ -633,29 +981,17 @@ class ConferenceApi(remote.Service):
 
     def _copySessionToForm(self, session):
         """Copy relevant fields from Session to SessionForm."""
-        sf = SessionForm()
-        for field in sf.all_fields():
-            if hasattr(session, field.name):
-                # convert Date/Time to date/time string; just copy others
-                if field.name.endswith('Date') or field.name.endswith('Time'):
-                    setattr(sf, field.name, str(getattr(session, field.name)))
-                else:
-                    setattr(sf, field.name, getattr(session, field.name))
-            elif field.name == "websafeKey":
-                setattr(sf, field.name, session.key.urlsafe())
-        sf.check_initialized()
-        return sf
+        return sessionSerializer.toForm(session)
 
 
-    def _createSessionObject(self, request):
-        """Create or session object, returning SessionForm/request."""
+    def _getOrganizedConference(self, websafeConferenceKey):
+        """Return conference, checking the user is its organizer."""
 
         # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        conf = ndb.Key(urlsafe=websafeConferenceKey).get()
         if not conf:
             raise endpoints.NotFoundException(
-                'No conference found with key: %s' %
-                request.websafeConferenceKey)
+                'No conference found with key: %s' % websafeConferenceKey)
 
         # get current user, must be organizer of conference
         user = endpoints.get_current_user()
@@ -666,6 +1002,11 @@ class ConferenceApi(remote.Service):
         if conf.organizerUserId != user_id:
             raise endpoints.UnauthorizedException(
                 'User is not the organizer of the conference')
+        return conf
+
+
+    def _sessionData(self, request):
+        """Return the Session properties of a SessionForm."""
 
         # check required fields
         if not request.name:
@@ -676,7 +1017,7 @@ class ConferenceApi(remote.Service):
         data = {field.name: getattr(request, field.name)
                 for field in request.all_fields()}
         del data['websafeKey']
-        del data['websafeConferenceKey']
+        data.pop('websafeConferenceKey', None)
 
         # convert dates and times from strings to date and time objects
         if data['startDate']:
@@ -685,24 +1026,83 @@ class ConferenceApi(remote.Service):
         if data['startTime']:
             data['startTime'] = datetime.strptime(
                 data['startTime'][:8], "%H:%M:%S").time()
+        return data
+
+
+    def _createSessionObject(self, request):
+        """Create or session object, returning SessionForm/request."""
+        conf = self._getOrganizedConference(request.websafeConferenceKey)
+        data = self._sessionData(request)
 
         # generate Session Key with parent conference key
         s_id = Session.allocate_ids(size=1, parent=conf.key)[0]
-        s_key = ndb.Key(Session, s_id, parent=conf.key)
-        data['key'] = s_key
+        data['key'] = ndb.Key(Session, s_id, parent=conf.key)
 
-        # create Session & return SessionForm
-        Session(**data).put()
+        # create Session, counting it for its speaker
+        session = Session(**data)
+        self._storeSessions([session])
 
         # task: if a speaker is referenced cache the speaker as
         # featured speaker provided the same speaker features
         # also in another session
         if request.speaker:
             taskqueue.add(
-                params={'speakerKey': request.speaker},
+                params={'speakerKey': request.speaker,
+                        'websafeConferenceKey': request.websafeConferenceKey},
                 url='/tasks/store_featured_speaker')
 
-        return self._copySessionToForm(s_key.get())
+        return self._copySessionToForm(session)
+
+
+    @staticmethod
+    def _checkSpeakers(wsspks):
+        """Raise NotFoundException unless all speakers exist."""
+        found = ndb.get_multi([ndb.Key(urlsafe=wsspk) for wsspk in wsspks])
+        for wsspk, speaker in zip(wsspks, found):
+            if not speaker:
+                raise endpoints.NotFoundException(
+                    'No speaker found with key: %s' % wsspk)
+
+
+    @ndb.transactional(xg=True)
+    def _storeSessions(self, sessions):
+        """Put sessions and add them to the sessions of their speakers."""
+        spoken = [session for session in sessions if session.speaker]
+        if spoken:
+            self._checkSpeakers(
+                sorted(set(session.speaker for session in spoken)))
+            speakers.addSessions(spoken)
+        ndb.put_multi(sessions)
+
+
+    @staticmethod
+    def _speakerBatches(sessions):
+        """Split sessions into batches with at most MAX_TXN_SPEAKERS
+        speakers each."""
+        batches, batch, batch_speakers = [], [], set()
+        for session in sorted(sessions, key=lambda s: s.speaker):
+            if session.speaker and session.speaker not in batch_speakers \
+                    and len(batch_speakers) == MAX_TXN_SPEAKERS:
+                batches.append(batch)
+                batch, batch_speakers = [], set()
+            batch.append(session)
+            if session.speaker:
+                batch_speakers.add(session.speaker)
+        if batch:
+            batches.append(batch)
+        return batches
+
+
+    @ndb.transactional(xg=True)
+    def _deleteSession(self, s_key):
+        """Delete session and remove it from the sessions of its speaker;
+        return the deleted session (None if it did not exist)."""
+        session = s_key.get()
+        if session:
+            if session.speaker:
+                speakers.removeSession(session)
+            s_key.delete()
+        return session
 
 
     @endpoints.method(SESSION_POST_REQUEST, SessionForm, path='session',
@@ -712,32 +1112,76 @@ class ConferenceApi(remote.Service):
         return self._createSessionObject(request)
 
 
+    @endpoints.method(SESSIONS_POST_REQUEST, SessionForms, path='sessions',
+                      http_method='POST', name='createSessions')
+    def createSessions(self, request):
+        """Create several sessions of a conference at once."""
+        conf = self._getOrganizedConference(request.websafeConferenceKey)
+        if len(request.sessions) > MAX_BATCH_SIZE:
+            raise endpoints.BadRequestException(
+                'At most %d sessions per request' % MAX_BATCH_SIZE)
+        data = [self._sessionData(form) for form in request.sessions]
+        if not data:
+            return SessionForms()
+
+        # allocate the ids of all sessions at once
+        first, last = Session.allocate_ids(size=len(data), parent=conf.key)
+        sessions = [Session(key=ndb.Key(Session, s_id, parent=conf.key),
+                            **session_data)
+                    for s_id, session_data in zip(xrange(first, last + 1),
+                                                  data)]
+
+        # check all speakers up front, so no batch is stored if one fails;
+        # the batches are stored (and counted for their speakers) in
+        # transactions within the entity group limit
+        wsspks = sorted(set(s.speaker for s in sessions if s.speaker))
+        self._checkSpeakers(wsspks)
+        for batch in self._speakerBatches(sessions):
+            self._storeSessions(batch)
+
+        # task: one task updates the featured speaker for all speakers
+        if wsspks:
+            taskqueue.add(
+                params={'speakerKey': wsspks,
+                        'websafeConferenceKey': request.websafeConferenceKey},
+                url='/tasks/store_featured_speaker')
+
+        # the response is built from the stored entities
+        return SessionForms(sessions=sessionSerializer.toForms(sessions))
+
+
     @endpoints.method(SESSION_GET_REQUEST, BooleanMessage,
                       path='deleteSession',
                       http_method='DELETE', name='deleteSession')
     def deleteSession(self, request):
         """Delete session."""
 
-        # find all profiles containing the session key in their wishlist
-        profiles = Profile.query(
-            Profile.sessionKeysWishlist == request.websafeSessionKey)
+        # delete session
+        session = self._deleteSession(
+            ndb.Key(urlsafe=request.websafeSessionKey))
 
-        # remove the session key in the wishlist and store in datastore
-        for profile in profiles:
-            profile.sessionKeysWishlist.remove(request.websafeSessionKey)
-            profile.put()
+        # the speaker may no longer be featured
+        if session and session.speaker:
+            taskqueue.add(
+                params={'speakerKey': session.speaker,
+                        'websafeConferenceKey':
+                            session.key.parent().urlsafe()},
+                url='/tasks/store_featured_speaker')
 
-        # delete session
-        ndb.Key(urlsafe=request.websafeSessionKey).delete()
+        # remove the session key from the wishlists referencing it,
+        # large fan-outs are continued in background tasks
+        cascade.deleteSession(request.websafeSessionKey)
 
         return BooleanMessage(data=True)
 
 
-    @endpoints.method(CONF_GET_REQUEST, SessionForms,
+    @endpoints.method(SESSIONS_GET_REQUEST, SessionForms,
                       path='session/{websafeConferenceKey}',
                       http_method='GET', name='getConferenceSessions')
     def getConferenceSessions(self, request):
         """Return sessions of conference."""
+        serializer = self._maskedSerializer(
+            sessionSerializer, request.fieldMask)
 
         # create ancestor query for all session children of conference ancestor
         sessions = Session.query(ancestor=ndb.Key(
@@ -745,7 +1189,9 @@ class ConferenceApi(remote.Service):
 
         # return set of SessionForm objects for the conference
         return SessionForms(
-            sessions=[self._copySessionToForm(session) for session in sessions]
+            sessions=self._fetchMasked(
+                sessions, serializer,
+                maskProjection(serializer, Session, ancestor=True))
         )
 
 
@@ -762,43 +1208,69 @@ class ConferenceApi(remote.Service):
         # add filter for the specified session type to the query
         sessions = sessions.filter(Session.sessionType == request.sessionType)
 
-        # return set of SessionForm objects
+        # return set of SessionForm objects (no index serves projections
+        # with this filter, so only keys-only masks save the fetch)
         return SessionForms(
-            sessions=[self._copySessionToForm(session) for session in sessions]
+            sessions=self._fetchMasked(sessions, self._maskedSerializer(
+                sessionSerializer, request.fieldMask))
         )
 
 
-    @endpoints.method(SPEAKER_GET_REQUEST, SessionForms,
+    @endpoints.method(SPEAKER_SESSIONS_GET_REQUEST, SessionForms,
                       path='sessionsBySpeaker',
                       http_method='GET', name='getSessionsBySpeaker')
     def getSessionsBySpeaker(self, request):
-        """Return conference sessions with specified speaker."""
-
-        # retrieve all sessions in which speaker is referenced as their speaker
-        sessions = Session.query().filter(
-                        Session.speaker == request.websafeSpeakerKey)
+        """Return conference sessions with specified speaker; in summary
+        mode only their names and keys."""
+        serializer = self._maskedSerializer(
+            sessionSerializer, request.fieldMask)
+
+        # the session keys and names are maintained per speaker
+        stats = speakers.speakerSessions(request.websafeSpeakerKey)
+        if stats is None:
+            # speaker not indexed yet: retrieve all sessions in which
+            # speaker is referenced as their speaker
+            sessions = Session.query().filter(
+                            Session.speaker == request.websafeSpeakerKey)
+        elif request.summary:
+            return SessionForms(
+                sessions=[SessionForm(name=name, websafeKey=wssk)
+                          for wssk, name in zip(stats.sessionKeys,
+                                                stats.sessionNames)]
+            )
+        elif serializer.keysOnly():
+            return SessionForms(sessions=serializer.fromKeys(
+                [ndb.Key(urlsafe=wssk) for wssk in stats.sessionKeys]))
+        else:
+            # sessions are served from the ndb cache where possible
+            sessions = ndb.get_multi(
+                [ndb.Key(urlsafe=wssk) for wssk in stats.sessionKeys])
 
         # return set of SessionForm objects for the retrieved sessions
         return SessionForms(
-            sessions=[self._copySessionToForm(session) for session in sessions]
+            sessions=serializer.toForms(
+                [session for session in sessions if session])
         )
 
 
-    @endpoints.method(SESSION_GET_REQUEST, ProfileForms,
+    @endpoints.method(WISHLISTERS_GET_REQUEST, ProfileForms,
                       path='getSessionWishfulAttendees',
                       http_method='GET',
                       name='getSessionWishfulAttendees')
     def getSessionWishfulAttendees(self, request):
         """Query for users wishing to attend the specified session."""
 
+        serializer = self._maskedSerializer(
+            profileSerializer, request.fieldMask)
+
         # find all profiles containing the session key in their wishlist
-        profiles = Profile.query(Profile.sessionKeysWishlist ==
-                                 request.websafeSessionKey)
+        profiles = ndb.get_multi(
+            wishlists.wishlisterKeys(request.websafeSessionKey))
 
         # return profiles
         return ProfileForms(
-                profiles=[self._copyProfileToForm(profile)
-                          for profile in profiles]
+                profiles=serializer.toForms(
+                    [prof for prof in profiles if prof])
         )
 
 
@@ -823,16 +1295,31 @@ class ConferenceApi(remote.Service):
 
         if profile:
             # enter the sessions key to the user's withlist and
-            # store in datastore
-            if request.websafeSessionKey not in profile.sessionKeysWishlist:
-                profile.sessionKeysWishlist.append(request.websafeSessionKey)
-                profile.put()
+            # store in datastore (checked on the stored Profile, the
+            # cached one may be stale)
+            caching.setProfile(self._updateWishlist(
+                profile.key, request.websafeSessionKey, add=True))
             retval = True
 
         return BooleanMessage(data=retval)
 
 
-    @endpoints.method(message_types.VoidMessage, SessionForms,
+    @ndb.transactional()
+    def _updateWishlist(self, p_key, wssk, add):
+        """Add session key to (or remove it from) the wishlist of the
+        stored Profile; the cached Profile may be slightly stale."""
+        profile = p_key.get()
+        if add and wssk not in profile.sessionKeysWishlist:
+            profile.sessionKeysWishlist.append(wssk)
+            ndb.put_multi([profile, wishlists.newEntry(p_key, wssk)])
+        elif not add and wssk in profile.sessionKeysWishlist:
+            profile.sessionKeysWishlist.remove(wssk)
+            profile.put()
+            wishlists.entryKey(p_key, wssk).delete()
+        return profile
+
+
+    @endpoints.method(LIST_GET_REQUEST, SessionForms,
                       path='getSessionsInWishlist',
                       http_method='GET', name='getSessionsInWishlist')
     def getSessionsInWishlist(self, request):
@@ -841,15 +1328,20 @@ class ConferenceApi(remote.Service):
         # get Profile of current user
         profile = self._getProfileFromUser()
 
-        # retrieve all sessions referenced in the user's wishlist
+        serializer = self._maskedSerializer(
+            sessionSerializer, request.fieldMask)
+
+        # retrieve all sessions referenced in the user's wishlist (looked
+        # up by key to skip deleted sessions, so they cannot be projected)
         session_keys = [ndb.Key(urlsafe=sKey)
                         for sKey in profile.sessionKeysWishlist]
         sessions = ndb.get_multi(session_keys)
 
         # return SessionForms response with all SessionForms of sessions
-        # referenced in wishlist
+        # referenced in wishlist (skipping sessions deleted meanwhile)
         return SessionForms(
-            sessions=[self._copySessionToForm(session) for session in sessions]
+            sessions=serializer.toForms(
+                [session for session in sessions if session])
         )
 
 
@@ -864,9 +1356,8 @@ class ConferenceApi(remote.Service):
 
         # the session key has to be removed from the wishlist (if present)
         # independent of whether the session does or does not exist
-        if request.websafeSessionKey in profile.sessionKeysWishlist:
-            profile.sessionKeysWishlist.remove(request.websafeSessionKey)
-            profile.put()
+        caching.setProfile(self._updateWishlist(
+            profile.key, request.websafeSessionKey, add=False))
 
         # as an "add on" the existence of the referenced session is checked
         session = ndb.Key(urlsafe=request.websafeSessionKey).get()
@@ -882,20 +1373,11 @@ class ConferenceApi(remote.Service):
 
     def _copySpeakerToForm(self, speaker):
         """Copy relevant fields from Speaker to SpeakerForm."""
-        # for all fields in SpeakerForm copy the analogous parameter in the
-        # Speaker object to the SpeakerForm
-        sf = SpeakerForm()
-        for field in sf.all_fields():
-            if hasattr(speaker, field.name):
-                setattr(sf, field.name, getattr(speaker, field.name))
-            elif field.name == "websafeKey":
-                setattr(sf, field.name, speaker.key.urlsafe())
-        sf.check_initialized()
-        return sf
+        return speakerSerializer.toForm(speaker)
 
 
-    def _createSpeakerObject(self, request):
-        """Create speaker object, returning speakerForm/request."""
+    def _speakerData(self, request):
+        """Return the Speaker properties of a SpeakerForm."""
 
         # check the required fields and throw exception is not set
         if not request.firstName:
@@ -909,14 +1391,20 @@ class ConferenceApi(remote.Service):
         data = {field.name: getattr(request, field.name)
                 for field in request.all_fields()}
         del data['websafeKey']
+        return data
+
+
+    def _createSpeakerObject(self, request):
+        """Create speaker object, returning speakerForm/request."""
+        data = self._speakerData(request)
 
         # generate an ndb key for the new Speaker entry
         s_id = Speaker.allocate_ids(size=1)[0]
         s_key = ndb.Key(Speaker, s_id)
         data['key'] = s_key
 
-        # create Speaker & return SpeakerForm
-        Speaker(**data).put()
+        # create Speaker with its (empty) session index & return SpeakerForm
+        ndb.put_multi([Speaker(**data), speakers.newSpeakerSessions(s_key)])
 
         return request
 
@@ -928,57 +1416,97 @@ class ConferenceApi(remote.Service):
         return self._createSpeakerObject(request)
 
 
-    @endpoints.method(SPEAKER_GET_REQUEST, BooleanMessage,
+    @endpoints.method(SpeakerForms, SpeakerForms, path='createSpeakers',
+                      http_method='POST', name='createSpeakers')
+    def createSpeakers(self, request):
+        """Create several speakers at once."""
+        if len(request.speakers) > MAX_BATCH_SIZE:
+            raise endpoints.BadRequestException(
+                'At most %d speakers per request' % MAX_BATCH_SIZE)
+        data = [self._speakerData(form) for form in request.speakers]
+        if not data:
+            return SpeakerForms()
+
+        # allocate the ids of all speakers at once and store the speakers
+        # with their (empty) session indexes
+        first, last = Speaker.allocate_ids(size=len(data))
+        new_speakers = [Speaker(key=ndb.Key(Speaker, s_id), **speaker_data)
+                        for s_id, speaker_data in zip(xrange(first, last + 1),
+                                                      data)]
+        ndb.put_multi(new_speakers + [speakers.newSpeakerSessions(sp.key)
+                                      for sp in new_speakers])
+
+        # the response is built from the stored entities
+        return SpeakerForms(
+            speakers=speakerSerializer.toForms(new_speakers))
+
+
+    @endpoints.method(SPEAKER_GET_REQUEST, CascadeStatusForm,
                       path='deleteSpeaker',
                       http_method='DELETE', name='deleteSpeaker')
     def deleteSpeaker(self, request):
-        """Delete speaker."""
+        """Delete speaker; references in sessions are reset in the
+        background, see getCascadeStatus."""
+
+        # delete the speaker with its session counts
+        ndb.Key(urlsafe=request.websafeSpeakerKey).delete()
+        speakers.deleteSpeaker(request.websafeSpeakerKey)
 
-        # find all sessions containing the speaker key
-        sessions = Session.query(Session.speaker == request.websafeSpeakerKey)
+        # reset the speakerKey property of all sessions containing the
+        # speaker key in chunks in background tasks
+        job = cascade.deleteSpeaker(request.websafeSpeakerKey)
 
-        # for each of these sessions reset the speakerKey property and store
-        for session in sessions:
-            session.speaker = ''
-            session.put()
+        return self._copyCascadeJobToForm(job)
 
-        # delete the session
-        ndb.Key(urlsafe=request.websafeSpeakerKey).delete()
 
-        return BooleanMessage(data=True)
+    def _copyCascadeJobToForm(self, job):
+        """Copy relevant fields from CascadeJob to CascadeStatusForm."""
+        cf = CascadeStatusForm(
+            data=True,
+            job=job.key.urlsafe(),
+            status=getattr(CascadeStatus, job.status),
+            processed=job.processed)
+        cf.check_initialized()
+        return cf
+
+
+    @endpoints.method(JOB_GET_REQUEST, CascadeStatusForm,
+                      path='cascade/{job}',
+                      http_method='GET', name='getCascadeStatus')
+    def getCascadeStatus(self, request):
+        """Return progress of a background cascade (e.g. deleteSpeaker)."""
+        job = ndb.Key(urlsafe=request.job).get()
+        if not job:
+            raise endpoints.NotFoundException(
+                'No cascade job found: %s' % request.job)
+        return self._copyCascadeJobToForm(job)
 
 
-    @endpoints.method(message_types.VoidMessage, SpeakerForms,
+    @endpoints.method(LIST_GET_REQUEST, SpeakerForms,
                       path='getSpeakers',
                       http_method='GET', name='getSpeakers')
     def getSpeakers(self, request):
         """Return all speakers."""
+        serializer = self._maskedSerializer(
+            speakerSerializer, request.fieldMask)
         # returns the speaker objects of all speakers stored in the datastore
         speakers = Speaker.query()
         return SpeakerForms(
-            speakers=[self._copySpeakerToForm(speaker) for speaker in speakers]
+            speakers=self._fetchMasked(
+                speakers, serializer, maskProjection(serializer, Speaker))
         )
 
 
 # - - - Featured Speaker - - - - - - - - - - - - - - - - - - - -
 
     @staticmethod
-    def _cacheFeaturedSpeaker(speakerKey):
+    def _cacheFeaturedSpeaker(speakerKey, websafeConferenceKey=None):
         """Set speaker as featured speaker in memcache
            if speaker features in at least 2 sessions.
         """
-        # retrieve all sessions referencing the specified speaker
-        sessions = Session.query(Session.speaker == speakerKey).fetch()
-
-        if len(sessions) >= 2:
-            # Speaker features in at least 2 sessions, so is stored in memcache
-            # with key MEMCACHE_FEATURED_SPEAKER_KEY
-            speaker = ndb.Key(urlsafe=speakerKey).get()
-            speakerName = speaker.firstName + ' ' + speaker.familyName
-            featuredSpeakerText = FEATURED_SPEAKER_TPL % \
-                (speakerName, ', '.join(session.name for session in sessions))
-            memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY, featuredSpeakerText)
-        return
+        # the sessions of the speaker are counted incrementally,
+        # so no query over the sessions is needed
+        speakers.cacheFeaturedSpeaker(speakerKey, websafeConferenceKey)
 
 
     @endpoints.method(message_types.VoidMessage, StringMessage,
@@ -987,8 +1515,66 @@ class ConferenceApi(remote.Service):
     def getFeaturedSpeaker(self, request):
         """Return the featured speaker from memcache if there is any."""
         return StringMessage(
-            data=memcache.get(MEMCACHE_FEATURED_SPEAKER_KEY) or "")
+            data=caching.getGlobal(
+                speakers.MEMCACHE_FEATURED_SPEAKER_KEY) or "")
+
+
+    @endpoints.method(FEATURED_GET_REQUEST, FeaturedSpeakerForms,
+                      path='speaker/featured/conferences',
+                      http_method='GET', name='getFeaturedSpeakers')
+    def getFeaturedSpeakers(self, request):
+        """Return the featured speakers of the given conferences."""
+        wscks = request.websafeConferenceKey
+        return FeaturedSpeakerForms(
+            items=[FeaturedSpeakerForm(websafeConferenceKey=wsck, data=text)
+                   for wsck, text in zip(
+                       wscks, speakers.featuredSpeakers(wscks))]
+        )
+
+
+
+# - - - Session queries with multiple inequality filters - - - - - - -
+
+    def _formatSessionFilters(self, filters):
+        """Parse, check validity and format user supplied session filters
+        into predicates."""
+        predicates = []
+        for f in filters:
+            if f.field not in sessionquery.CONVERTERS or \
+                    f.operator not in OPERATORS:
+                raise endpoints.BadRequestException(
+                    "Filter contains invalid field or operator.")
+            try:
+                predicates.append(sessionquery.Predicate(
+                    f.field, OPERATORS[f.operator], f.value or ''))
+            except ValueError:
+                raise endpoints.BadRequestException(
+                    "Filter contains invalid value for field %s." % f.field)
+        return predicates
+
+
+    @endpoints.method(SessionQueryForms, SessionForms,
+                      path='querySessions',
+                      http_method='POST', name='querySessions')
+    def querySessions(self, request):
+        """Query sessions with any number of inequality filters on
+        startTime, sessionType, duration, startDate, topics and speaker."""
+        serializer = self._maskedSerializer(
+            sessionSerializer, request.fieldMask)
+        predicates = self._formatSessionFilters(request.filters)
+        ancestor = None
+        if request.websafeConferenceKey:
+            ancestor = ndb.Key(urlsafe=request.websafeConferenceKey)
+
+        try:
+            sessions, plan = sessionquery.querySessions(predicates, ancestor)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
 
+        return SessionForms(
+            sessions=serializer.toForms(sessions),
+            plan=plan if request.debug else None
+        )
 
 
 # - - - Problem of multiple inequality filters in query - - - - - - - -
@@ -1014,7 +1600,7 @@ class ConferenceApi(remote.Service):
 
         # retrieval returns a BadRequestError
         return SessionForms(
-            sessions=[self._copySessionToForm(session) for session in q]
+            sessions=sessionSerializer.toForms(q)
         )
 
 
@@ -1044,7 +1630,7 @@ class ConferenceApi(remote.Service):
             Session.sessionType == 'OTHER'))
 
         return SessionForms(
-            sessions=[self._copySessionToForm(session) for session in q]
+            sessions=sessionSerializer.toForms(q)
         )
 
 
@@ -1072,7 +1658,7 @@ class ConferenceApi(remote.Service):
             set(session_keys1).intersection(session_keys2))
 
         return SessionForms(
-            sessions=[self._copySessionToForm(session) for session in sessions]
+            sessions=sessionSerializer.toForms(sessions)
         )
 
 
@@ -1099,7 +1685,7 @@ class ConferenceApi(remote.Service):
                 sessions.append(session)
 
         return SessionForms(
-            sessions=[self._copySessionToForm(session) for session in sessions]
+            sessions=sessionSerializer.toForms(sessions)
         )
 
 
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+"""
+conferencequery.py -- index-aware query planner for queryConferences
+
+The composite indexes of Conference are read from index.yaml at startup.
+A filter combination is executed as one datastore query if an index
+serves it (equality properties followed by the sort order). Otherwise
+the planner picks the largest subset of the filters that an existing
+index can serve, runs that query and evaluates the remaining filters in
+memory, scanning at most MAX_SCANNED entities per page; the page token
+then continues the scan where it stopped.
+
+"!=" filters are always evaluated in memory: ndb runs them as two
+merged queries, which only support cursors when ordered by key.
+"""
+
+import itertools
+import os
+
+import yaml
+from google.appengine.ext import ndb
+
+from models import Conference
+from sessionquery import COMPARATORS
+
+INDEX_FILE = os.path.join(os.path.dirname(__file__), 'index.yaml')
+MAX_SCANNED = 500
+
+# indexed properties needed by the compact list view
+LIST_PROJECTION = ('name', 'city', 'startDate', 'maxAttendees',
+                   'seatsAvailable', 'organizerUserId')
+
+
+def loadIndexes(path=INDEX_FILE, kind='Conference', ancestor=False):
+    """Return property name tuples of the ascending composite indexes
+    of kind in index.yaml (the ancestor ones if ancestor is True)."""
+    try:
+        with open(path) as f:
+            config = yaml.safe_load(f) or {}
+    except (IOError, yaml.YAMLError):
+        return []
+    indexes = []
+    for index in config.get('indexes') or []:
+        props = index.get('properties') or []
+        if index.get('kind') != kind or \
+                bool(index.get('ancestor')) != ancestor or \
+                any(p.get('direction', 'asc') != 'asc' for p in props):
+            continue
+        indexes.append(tuple(p['name'] for p in props))
+    return indexes
+
+
+COMPOSITE_INDEXES = loadIndexes()
+
+
+def isIndexed(equality_fields, order_fields, projection=()):
+    """Return True if a query with equality filters on equality_fields
+    sorted by order_fields (and projecting projection) can be served by
+    an index."""
+    extra = sorted(set(projection) - set(order_fields))
+    if not equality_fields and len(order_fields) + len(extra) <= 1:
+        return True     # built-in single property index
+    n, m = len(equality_fields), len(order_fields)
+    for props in COMPOSITE_INDEXES:
+        if len(props) == n + m + len(extra) and \
+                sorted(props[:n]) == sorted(equality_fields) and \
+                list(props[n:n + m]) == list(order_fields) and \
+                sorted(props[n + m:]) == extra:
+            return True
+    return False
+
+
+class Plan(object):
+    """Plan -- Conference query plan: indexed filters plus filters
+    evaluated in memory"""
+
+    def __init__(self, indexed, residual, inequality_field):
+        self.indexed = indexed
+        self.residual = residual
+        self.inequality_field = inequality_field
+
+    def _order(self):
+        """Return sort order property names of the query."""
+        if self.inequality_field:
+            return [self.inequality_field, 'name']
+        return ['name']
+
+    def projection(self, fields):
+        """Return the fields to project for a view of fields (the values
+        of equality filters cannot be projected, see knownValues), or
+        None if no index supports the projection."""
+        equality_fields = [f["field"] for f in self.indexed
+                           if f["operator"] == "="]
+        projection = [f for f in fields if f not in equality_fields]
+        if any(f["field"] not in projection for f in self.residual):
+            return None
+        if not isIndexed(equality_fields, self._order(), projection):
+            return None
+        return projection
+
+    def knownValues(self):
+        """Return values of the fields fixed by equality filters."""
+        return dict((f["field"], f["value"]) for f in self.indexed
+                    if f["operator"] == "=")
+
+    def query(self):
+        """Return the datastore query of the indexed filters."""
+        q = Conference.query()
+        # If exists, sort on inequality filter first
+        if self.inequality_field:
+            q = q.order(ndb.GenericProperty(self.inequality_field))
+        q = q.order(Conference.name)
+        for filtr in self.indexed:
+            q = q.filter(ndb.query.FilterNode(
+                filtr["field"], filtr["operator"], filtr["value"]))
+        return q
+
+    def _matches(self, conf):
+        """Evaluate the residual filters on conf in memory."""
+        for filtr in self.residual:
+            compare = COMPARATORS[filtr["operator"]]
+            value = getattr(conf, filtr["field"])
+            if isinstance(value, list):
+                if not any(compare(v, filtr["value"]) for v in value):
+                    return False
+            elif value is None or not compare(value, filtr["value"]):
+                return False
+        return True
+
+    def fetch_page(self, page_size, start_cursor=None, projection=None):
+        """Return (entities, cursor, more) like Query.fetch_page."""
+        if not self.residual:
+            return self.query().fetch_page(
+                page_size, start_cursor=start_cursor, projection=projection)
+
+        it = self.query().iter(start_cursor=start_cursor,
+                               projection=projection,
+                               produce_cursors=True,
+                               batch_size=min(page_size * 4, MAX_SCANNED))
+        confs, scanned = [], 0
+        for conf in it:
+            scanned += 1
+            if self._matches(conf):
+                confs.append(conf)
+            if len(confs) >= page_size or scanned >= MAX_SCANNED:
+                break
+        if not scanned:
+            return confs, None, False
+        more = it.probably_has_next()
+        return confs, it.cursor_after() if more else None, more
+
+    def __str__(self):
+        fmt = lambda fs: ', '.join(
+            '%s%s%s' % (f["field"], f["operator"], f["value"]) for f in fs)
+        return 'index[%s] memory[%s]' % (fmt(self.indexed),
+                                          fmt(self.residual))
+
+
+def plan(filters):
+    """Return Plan for formatted filters (see _formatFilters), using the
+    largest subset of the filters an existing index can serve."""
+    equalities = [f for f in filters if f["operator"] == "="]
+    inequalities = [f for f in filters if f["operator"] not in ("=", "!=")]
+    inequality_field = inequalities[0]["field"] if inequalities else None
+
+    best = None
+    for use_inequality in ([True, False] if inequalities else [False]):
+        order = [inequality_field, 'name'] if use_inequality else ['name']
+        for r in range(len(equalities), -1, -1):
+            for subset in itertools.combinations(equalities, r):
+                if not isIndexed([f["field"] for f in subset], order):
+                    continue
+                score = r + (len(inequalities) if use_inequality else 0)
+                if best is None or score > best[0]:
+                    best = (score, list(subset), use_inequality)
+                break   # other subsets of this size score the same
+
+    score, indexed, use_inequality = best
+    if use_inequality:
+        indexed += inequalities
+    residual = [f for f in filters if not any(f is i for i in indexed)]
+    return Plan(indexed, residual,
+                inequality_field if use_inequality else None)
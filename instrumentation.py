@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+"""
+instrumentation.py -- per-endpoint RPC counts and latency histograms
+
+The instrumented class decorator wraps every remote method of an API
+class. While a method runs, API call hooks count its datastore gets,
+puts and queries, memcache hits and misses and enqueued tasks on a
+thread-local record. When the method returns, the counts and its
+latency bucket are added to memcache counters with one (asynchronous)
+offset_multi call. stats() turns the counters into per-endpoint totals
+and p50/p95/p99 latencies (upper bounds of the histogram buckets).
+"""
+
+import functools
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+
+MEMCACHE_STATS_KEY = "ENDPOINT_STATS:%s:%s"
+# upper bounds (ms) of the latency histogram buckets
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000,
+                   60000)
+COUNTERS = ('calls', 'errors', 'datastore_get', 'datastore_put',
+            'datastore_query', 'memcache_hit', 'memcache_miss', 'tasks')
+PERCENTILES = (50, 95, 99)
+
+_current = threading.local()
+_endpoints = []
+
+
+def _countCall(service, call, request, response):
+    """API post-call hook: count the call for the running endpoint."""
+    counts = getattr(_current, 'counts', None)
+    if counts is None:
+        return
+    if service == 'datastore_v3':
+        name = {'Get': 'datastore_get', 'Put': 'datastore_put',
+                'RunQuery': 'datastore_query'}.get(call)
+        if name:
+            counts[name] += 1
+    elif service == 'memcache' and call == 'Get':
+        hits = response.item_size()
+        counts['memcache_hit'] += hits
+        counts['memcache_miss'] += request.key_size() - hits
+    elif service == 'taskqueue' and call == 'BulkAdd':
+        counts['tasks'] += request.add_request_size()
+
+
+def _installHooks():
+    """Install the counting hook once per instance."""
+    hooks = apiproxy_stub_map.apiproxy.GetPostCallHooks()
+    hooks.Append('instrumentation', _countCall)
+
+
+def _bucket(latency_ms):
+    """Return the upper bound of the histogram bucket of a latency."""
+    for bound in LATENCY_BUCKETS:
+        if latency_ms <= bound:
+            return bound
+    return LATENCY_BUCKETS[-1]
+
+
+def _record(name, counts, latency_ms):
+    """Add the counts and latency of one call of endpoint name."""
+    mapping = dict((MEMCACHE_STATS_KEY % (name, counter), value)
+                   for counter, value in counts.items() if value)
+    mapping[MEMCACHE_STATS_KEY % (name, 'ms<=%d' % _bucket(latency_ms))] = 1
+    mapping[MEMCACHE_STATS_KEY % (name, 'ms')] = int(latency_ms)
+    # not waited for; outstanding RPCs complete with the request
+    memcache.Client().offset_multi_async(mapping, initial_value=0)
+
+
+def _wrap(name, method):
+    """Return method counting its RPCs and latency."""
+    @functools.wraps(method)
+    def wrapper(self, request):
+        _current.counts = dict.fromkeys(COUNTERS, 0)
+        _current.counts['calls'] = 1
+        start = time.time()
+        try:
+            return method(self, request)
+        except Exception:
+            _current.counts['errors'] = 1
+            raise
+        finally:
+            counts, _current.counts = _current.counts, None
+            _record(name, counts, (time.time() - start) * 1000)
+    return wrapper
+
+
+def instrumented(cls):
+    """Class decorator: instrument all remote methods of a Service."""
+    if not _endpoints:
+        _installHooks()
+    for name in sorted(cls.all_remote_methods()):
+        setattr(cls, name, _wrap(name, cls.__dict__[name]))
+        _endpoints.append(name)
+    return cls
+
+
+def _percentile(histogram, calls, percentile):
+    """Return the bucket bound below which percentile of calls fall."""
+    seen = 0
+    for bound in LATENCY_BUCKETS:
+        seen += histogram.get(bound, 0)
+        if seen * 100 >= calls * percentile:
+            return bound
+    return LATENCY_BUCKETS[-1]
+
+
+def _keys():
+    """Return the memcache keys of all counters of all endpoints."""
+    counters = COUNTERS + ('ms',) + tuple(
+        'ms<=%d' % bound for bound in LATENCY_BUCKETS)
+    return [MEMCACHE_STATS_KEY % (name, counter) for name in _endpoints
+            for counter in counters]
+
+
+def stats():
+    """Return dict of per-endpoint counters (totals), average latency
+    and latency percentiles of all endpoints called so far."""
+    values = memcache.get_multi(_keys())
+    result = {}
+    for name in _endpoints:
+        calls = int(values.get(MEMCACHE_STATS_KEY % (name, 'calls'), 0))
+        if not calls:
+            continue
+        entry = dict((counter, int(values.get(
+            MEMCACHE_STATS_KEY % (name, counter), 0)))
+            for counter in COUNTERS)
+        entry['avg_ms'] = int(values.get(
+            MEMCACHE_STATS_KEY % (name, 'ms'), 0)) / calls
+        histogram = dict((bound, int(values.get(
+            MEMCACHE_STATS_KEY % (name, 'ms<=%d' % bound), 0)))
+            for bound in LATENCY_BUCKETS)
+        for percentile in PERCENTILES:
+            entry['p%d_ms' % percentile] = _percentile(
+                histogram, calls, percentile)
+        result[name] = entry
+    return result
+
+
+def reset():
+    """Drop the counters of all endpoints."""
+    memcache.delete_multi(_keys())
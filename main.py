@@ -12,25 +12,171 @@ created by wesc on 2014 may 24
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+import json
+
 import webapp2
 from google.appengine.api import app_identity
 from google.appengine.api import mail
+from google.appengine.api import taskqueue
 from conference import ConferenceApi
 
+import admission
+import cascade
+import instrumentation
+import registrations
+import seats
+import snapshot
+import speakers
+
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
-        """Set Announcement in Memcache."""
+        """Reconcile the Announcement and set it in Memcache."""
         ConferenceApi._cacheAnnouncement()
         self.response.set_status(204)
 
 
 class SetFeaturedSpeakerHandler(webapp2.RequestHandler):
     def post(self):
-        """Set featured speaker in Memcache."""
-        ConferenceApi._cacheFeaturedSpeaker(self.request.get('speakerKey'))
+        """Set featured speaker(s) in Memcache."""
+        for speakerKey in self.request.get_all('speakerKey'):
+            ConferenceApi._cacheFeaturedSpeaker(
+                speakerKey,
+                self.request.get('websafeConferenceKey') or None)
+        self.response.set_status(204)
+
+
+class RebuildSpeakerSessionsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Recompute the session counts of all speakers, chaining
+        itself over the speakers."""
+        cursor = speakers.rebuildAll(self.request.get('cursor'))
+        if cursor:
+            taskqueue.add(params={'cursor': cursor},
+                          url='/tasks/rebuild_speaker_sessions')
+        self.response.set_status(204)
+
+    def get(self):
+        """Start the rebuild (admin only)."""
+        self.post()
+
+
+class ReconcileSeatsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy the seat shard sum to Conference.seatsAvailable."""
+        seats.reconcile(self.request.get('websafeConferenceKey'))
+        self.response.set_status(204)
+
+
+class AdmitRegistrationsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Admit queued registrations of a hot conference."""
+        admission.process(self.request.get('websafeConferenceKey'))
+        self.response.set_status(204)
+
+    def get(self):
+        """Admit queued registrations of all conferences (cron)."""
+        while admission.process():
+            pass
+        self.response.set_status(204)
+
+
+class BackfillRegistrationsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Create Registration and WishlistEntry entities for existing
+        profiles, chaining itself over all profiles."""
+        cursor = registrations.backfill(self.request.get('cursor'))
+        if cursor:
+            taskqueue.add(params={'cursor': cursor},
+                          url='/tasks/backfill_registrations')
+        self.response.set_status(204)
+
+    def get(self):
+        """Start the backfill (admin only)."""
+        self.post()
+
+
+class CascadeSessionDeleteHandler(webapp2.RequestHandler):
+    def post(self):
+        """Remove a deleted session from the next chunk of wishlists."""
+        cascade.deleteSession(self.request.get('websafeSessionKey'),
+                              self.request.get('cursor'))
+        self.response.set_status(204)
+
+
+class CascadeSpeakerDeleteHandler(webapp2.RequestHandler):
+    def post(self):
+        """Reset a deleted speaker in the next chunk of sessions."""
+        cascade.continueSpeakerDelete(self.request.get('job'),
+                                      self.request.get('cursor'))
+        self.response.set_status(204)
+
+
+class ExportSnapshotHandler(webapp2.RequestHandler):
+    def post(self):
+        """Export the next chunk of a snapshot, chaining itself."""
+        snapshot.exportChunk(self.request.get('name'),
+                             int(self.request.get('kind')),
+                             self.request.get('cursor') or None,
+                             int(self.request.get('chunk')))
         self.response.set_status(204)
 
+    def get(self):
+        """Start exporting a snapshot (admin only)."""
+        snapshot.startExport(self.request.get('name'))
+        self.response.set_status(202)
+
+
+class RestoreSnapshotHandler(webapp2.RequestHandler):
+    def post(self):
+        """Restore the next chunk of a snapshot, chaining itself."""
+        snapshot.restoreChunk(self.request.get('name'),
+                              int(self.request.get('chunk')))
+        self.response.set_status(204)
+
+    def get(self):
+        """Start restoring a snapshot (admin only)."""
+        if not snapshot.startRestore(self.request.get('name')):
+            self.abort(404)
+        self.response.set_status(202)
+
+
+class SnapshotChunkHandler(webapp2.RequestHandler):
+    def get(self):
+        """Download one chunk of JSON lines of a snapshot (gzip=1 for a
+        gzip stream); the chunks concatenated form the whole snapshot."""
+        snap = snapshot.snapshotKey(self.request.get('name')).get()
+        compressed = self.request.get('gzip') == '1'
+        data = snapshot.readChunk(self.request.get('name'),
+                                  int(self.request.get('chunk', 1)),
+                                  compressed)
+        if not snap or data is None:
+            self.abort(404)
+        self.response.headers['Content-Type'] = (
+            'application/gzip' if compressed else 'application/x-ndjson')
+        self.response.headers['X-Snapshot-Chunks'] = str(snap.chunks)
+        self.response.headers['X-Snapshot-Status'] = str(snap.status)
+        self.response.out.write(data)
+
+    def post(self):
+        """Upload JSON lines (gzip=1 for a gzip stream) to a snapshot."""
+        snap = snapshot.uploadChunk(self.request.get('name'),
+                                    self.request.body,
+                                    self.request.get('gzip') == '1')
+        self.response.headers['X-Snapshot-Chunks'] = str(snap.chunks)
+        self.response.set_status(204)
+
+
+class EndpointStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Show RPC counts and latency percentiles per endpoint as JSON
+        (admin only); reset=1 clears the counters afterwards."""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.out.write(
+            json.dumps(instrumentation.stats(), indent=2, sort_keys=True))
+        if self.request.get('reset') == '1':
+            instrumentation.reset()
+
 
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
@@ -48,6 +194,17 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
 
 app = webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
+    ('/crons/admit_registrations', AdmitRegistrationsHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
     ('/tasks/store_featured_speaker', SetFeaturedSpeakerHandler),
+    ('/tasks/reconcile_seats', ReconcileSeatsHandler),
+    ('/tasks/admit_registrations', AdmitRegistrationsHandler),
+    ('/tasks/backfill_registrations', BackfillRegistrationsHandler),
+    ('/tasks/cascade_session_delete', CascadeSessionDeleteHandler),
+    ('/tasks/cascade_speaker_delete', CascadeSpeakerDeleteHandler),
+    ('/tasks/rebuild_speaker_sessions', RebuildSpeakerSessionsHandler),
+    ('/tasks/export_snapshot', ExportSnapshotHandler),
+    ('/tasks/restore_snapshot', RestoreSnapshotHandler),
+    ('/admin/snapshot', SnapshotChunkHandler),
+    ('/admin/endpoint_stats', EndpointStatsHandler),
 ], debug=True)
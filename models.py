@@ -26,8 +26,21 @@ class Profile(ndb.Model):
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
-    conferenceKeysToAttend = ndb.StringProperty(repeated=True)
-    sessionKeysWishlist = ndb.StringProperty(repeated=True)
+    # attendees are listed via Registration, so no index is needed here
+    conferenceKeysToAttend = ndb.StringProperty(repeated=True, indexed=False)
+    # wishlisters are found via WishlistEntry, so no index is needed here
+    sessionKeysWishlist = ndb.StringProperty(repeated=True, indexed=False)
+
+class Registration(ndb.Model):
+    """Registration -- registration for a Conference, child of Profile"""
+    conference      = ndb.StringProperty(required=True) # websafe key
+    displayName     = ndb.StringProperty()
+    mainEmail       = ndb.StringProperty()
+    teeShirtSize    = ndb.StringProperty()
+
+class WishlistEntry(ndb.Model):
+    """WishlistEntry -- Session in a user's wishlist, child of Profile"""
+    session         = ndb.StringProperty(required=True) # websafe key
 
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
@@ -45,6 +58,7 @@ class ProfileForm(messages.Message):
 class ProfileForms(messages.Message):
     """ProfileForms -- multiple Profile outbound form message"""
     profiles = messages.MessageField(ProfileForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
 
 
 class StringMessage(messages.Message):
@@ -55,6 +69,10 @@ class BooleanMessage(messages.Message):
     """BooleanMessage-- outbound Boolean value message"""
     data = messages.BooleanField(1)
 
+class IntegerMessage(messages.Message):
+    """IntegerMessage-- outbound Integer value message"""
+    data = messages.IntegerField(1)
+
 class Conference(ndb.Model):
     """Conference -- Conference object"""
     name            = ndb.StringProperty(required=True)
@@ -66,7 +84,20 @@ class Conference(ndb.Model):
     month           = ndb.IntegerProperty() # TODO: do we need for indexing like Java?
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
-    seatsAvailable  = ndb.IntegerProperty()
+    seatsAvailable  = ndb.IntegerProperty() # reconciled from seat shards
+    seatShards      = ndb.IntegerProperty(default=0, indexed=False)
+    hot             = ndb.BooleanProperty(default=False) # queued admission
+
+class SeatShard(ndb.Model):
+    """SeatShard -- one shard of the available seats of a Conference"""
+    seatsAvailable  = ndb.IntegerProperty(default=0, indexed=False)
+    attendees       = ndb.IntegerProperty(default=0, indexed=False)
+
+class NearlySoldOut(ndb.Model):
+    """NearlySoldOut -- the conferences with few seats left (singleton);
+    websafe keys and names in the same order"""
+    conferences     = ndb.StringProperty(repeated=True, indexed=False)
+    names           = ndb.StringProperty(repeated=True, indexed=False)
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -82,10 +113,27 @@ class ConferenceForm(messages.Message):
     endDate         = messages.StringField(10) #DateTimeField()
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    hot             = messages.BooleanField(13)
 
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+class ConferenceListForm(messages.Message):
+    """ConferenceListForm -- compact Conference outbound message for lists"""
+    name            = messages.StringField(1)
+    city            = messages.StringField(2)
+    startDate       = messages.StringField(3) #DateTimeField()
+    maxAttendees    = messages.IntegerField(4)
+    seatsAvailable  = messages.IntegerField(5)
+    websafeKey      = messages.StringField(6)
+    organizerDisplayName = messages.StringField(7)
+
+class ConferenceListForms(messages.Message):
+    """ConferenceListForms -- multiple ConferenceListForm outbound message"""
+    items = messages.MessageField(ConferenceListForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
 
 class TeeShirtSize(messages.Enum):
     """TeeShirtSize -- t-shirt size enumeration value"""
@@ -105,15 +153,45 @@ class TeeShirtSize(messages.Enum):
     XXXL_M = 14
     XXXL_W = 15
 
+class RegistrationStatus(messages.Enum):
+    """RegistrationStatus -- registration ticket status enumeration value"""
+    PENDING = 1
+    REGISTERED = 2
+    REJECTED = 3
+
+class RegistrationTicket(ndb.Model):
+    """RegistrationTicket -- queued registration request, child of Profile;
+    the id is the websafe conference key"""
+    conference      = ndb.StringProperty(required=True) # websafe key
+    status          = ndb.StringProperty(default='PENDING')
+    reason          = ndb.StringProperty(indexed=False)
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+
+class RegistrationStatusForm(messages.Message):
+    """RegistrationStatusForm -- outbound registration result message"""
+    data            = messages.BooleanField(1)
+    status          = messages.EnumField('RegistrationStatus', 2)
+    ticket          = messages.StringField(3)
+    reason          = messages.StringField(4)
+
 class ConferenceQueryForm(messages.Message):
     """ConferenceQueryForm -- Conference query inbound form message"""
     field = messages.StringField(1)
     operator = messages.StringField(2)
     value = messages.StringField(3)
 
+class QueryCacheStatsForm(messages.Message):
+    """QueryCacheStatsForm -- conference query cache statistics message"""
+    hits = messages.IntegerField(1)
+    misses = messages.IntegerField(2)
+    generation = messages.IntegerField(3)
+
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2)
+    cursor = messages.StringField(3)
+    fieldMask = messages.StringField(4, repeated=True)
 
 
 
@@ -168,6 +246,25 @@ class SessionForm(messages.Message):
 class SessionForms(messages.Message):
     """SessionForms -- multiple Session outbound form message"""
     sessions = messages.MessageField(SessionForm, 1, repeated=True)
+    plan = messages.StringField(2)
+
+
+# SessionQueryForm
+
+class SessionQueryForm(messages.Message):
+    """SessionQueryForm -- Session query inbound form message"""
+    field = messages.StringField(1)
+    operator = messages.StringField(2)
+    value = messages.StringField(3)
+
+# SessionQueryForms
+
+class SessionQueryForms(messages.Message):
+    """SessionQueryForms -- multiple SessionQueryForm inbound form message"""
+    filters = messages.MessageField(SessionQueryForm, 1, repeated=True)
+    websafeConferenceKey = messages.StringField(2)
+    debug = messages.BooleanField(3)
+    fieldMask = messages.StringField(4, repeated=True)
 
 
 
@@ -182,6 +279,17 @@ class Speaker(ndb.Model):
     expertise       = ndb.StringProperty(repeated=True)
 
 
+# SpeakerSessions
+
+class SpeakerSessions(ndb.Model):
+    """SpeakerSessions -- incrementally maintained sessions of a Speaker,
+    overall (id 'all') or in one Conference (id websafe conference key);
+    child of Speaker"""
+    sessionCount    = ndb.IntegerProperty(default=0, indexed=False)
+    sessionKeys     = ndb.StringProperty(repeated=True, indexed=False)
+    sessionNames    = ndb.StringProperty(repeated=True, indexed=False)
+
+
 # SpeakerForm
 
 class SpeakerForm(messages.Message):
@@ -198,3 +306,60 @@ class SpeakerForm(messages.Message):
 class SpeakerForms(messages.Message):
     """SpeakerForms -- multiple Speaker outbound form message"""
     speakers = messages.MessageField(SpeakerForm, 1, repeated=True)
+
+
+# FeaturedSpeakerForm
+
+class FeaturedSpeakerForm(messages.Message):
+    """FeaturedSpeakerForm -- featured speaker of a Conference message"""
+    websafeConferenceKey = messages.StringField(1)
+    data            = messages.StringField(2)
+
+# FeaturedSpeakerForms
+
+class FeaturedSpeakerForms(messages.Message):
+    """FeaturedSpeakerForms -- multiple FeaturedSpeakerForm message"""
+    items = messages.MessageField(FeaturedSpeakerForm, 1, repeated=True)
+
+
+# Background cascades
+
+class CascadeStatus(messages.Enum):
+    """CascadeStatus -- cascade job status enumeration value"""
+    RUNNING = 1
+    DONE = 2
+
+class CascadeJob(ndb.Model):
+    """CascadeJob -- progress of a chunked background cascade"""
+    target          = ndb.StringProperty(required=True) # websafe key
+    status          = ndb.StringProperty(default='RUNNING')
+    processed       = ndb.IntegerProperty(default=0)
+    cursor          = ndb.StringProperty(indexed=False) # next chunk
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+    updated         = ndb.DateTimeProperty(auto_now=True)
+
+class CascadeStatusForm(messages.Message):
+    """CascadeStatusForm -- outbound cascade job status message"""
+    data            = messages.BooleanField(1)
+    job             = messages.StringField(2)
+    status          = messages.EnumField('CascadeStatus', 3)
+    processed       = messages.IntegerField(4)
+
+
+# Dataset snapshots
+
+class Snapshot(ndb.Model):
+    """Snapshot -- JSONL export of the dataset, stored in chunks"""
+    status          = ndb.StringProperty(default='EXPORTING')
+    chunks          = ndb.IntegerProperty(default=0)
+    entities        = ndb.IntegerProperty(default=0)
+    restored        = ndb.IntegerProperty(default=0)
+    restoredChunks  = ndb.IntegerProperty(repeated=True, indexed=False)
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+    updated         = ndb.DateTimeProperty(auto_now=True)
+
+class SnapshotChunk(ndb.Model):
+    """SnapshotChunk -- JSONL lines of a Snapshot, child of Snapshot;
+    the id is the chunk number (starting at 1)"""
+    data            = ndb.BlobProperty(compressed=True)
+    entities        = ndb.IntegerProperty(default=0, indexed=False)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+"""
+registrations.py -- Registration entities backing attendee listings
+
+A Registration is a child of the registered user's Profile, so it is
+written in the same entity group (and transaction) as the Profile's
+conferenceKeysToAttend and adds no entity group to the registration
+transaction. Attendees of a conference are listed with a projection
+query on Registration.conference.
+"""
+
+from google.appengine.ext import ndb
+
+from models import Profile
+from models import Registration
+
+import wishlists
+
+BACKFILL_BATCH = 100
+ATTENDEE_PROJECTION = [Registration.displayName, Registration.mainEmail,
+                       Registration.teeShirtSize]
+
+
+def registrationKey(p_key, wsck):
+    """Return key of the Registration of a profile for a conference."""
+    return ndb.Key(Registration, wsck, parent=p_key)
+
+
+def newRegistration(prof, wsck):
+    """Return new Registration of prof for conference wsck."""
+    return Registration(key=registrationKey(prof.key, wsck),
+                        conference=wsck,
+                        displayName=prof.displayName,
+                        mainEmail=prof.mainEmail,
+                        teeShirtSize=prof.teeShirtSize)
+
+
+def attendeesQuery(wsck):
+    """Return query for the registrations of conference wsck."""
+    return Registration.query(Registration.conference == wsck)
+
+
+@ndb.transactional()
+def updateProfile(prof):
+    """Copy the changed profile fields to its registrations."""
+    regs = Registration.query(ancestor=prof.key).fetch()
+    for reg in regs:
+        reg.displayName = prof.displayName
+        reg.mainEmail = prof.mainEmail
+        reg.teeShirtSize = prof.teeShirtSize
+    ndb.put_multi(regs)
+
+
+def backfill(websafeCursor=None):
+    """Create missing registrations and wishlist entries for one batch
+    of profiles; return the websafe cursor of the next batch or None
+    when done."""
+    cursor = ndb.Cursor(urlsafe=websafeCursor) if websafeCursor else None
+    profiles, cursor, more = Profile.query().fetch_page(
+        BACKFILL_BATCH, start_cursor=cursor)
+    ndb.put_multi([newRegistration(prof, wsck) for prof in profiles
+                   for wsck in prof.conferenceKeysToAttend] +
+                  [wishlists.newEntry(prof.key, wssk) for prof in profiles
+                   for wssk in prof.sessionKeysWishlist])
+    return cursor.urlsafe() if more and cursor else None
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+"""
+seats.py -- sharded seat counters for conference registration
+
+The available seats of a conference are split over SEAT_SHARDS root
+entities (SeatShard), each in its own entity group. A registration only
+writes the user's Profile and one randomly chosen shard, so concurrent
+registrations for the same conference no longer contend on the
+Conference entity group. A shard never goes below zero, so the sum of
+all shards can never oversell the conference.
+
+Conference.seatsAvailable is kept as a reconciled copy of the shard sum
+for queries and listings; it is refreshed by a named (deduplicated) task
+at most once every RECONCILE_INTERVAL seconds per conference.
+"""
+
+import random
+import time
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import SeatShard
+
+import announcements
+import caching
+
+SEAT_SHARDS = 20
+RECONCILE_INTERVAL = 10     # seconds
+
+
+def _shardKeys(conf_key, count):
+    """Return the keys of the seat shards of a conference."""
+    wsck = conf_key.urlsafe()
+    return [ndb.Key(SeatShard, '%s-%d' % (wsck, i)) for i in range(count)]
+
+
+def _distribute(seats, count):
+    """Split seats as evenly as possible over count shards."""
+    base, extra = divmod(max(seats or 0, 0), count)
+    return [base + (1 if i < extra else 0) for i in range(count)]
+
+
+def createShards(conf, count=SEAT_SHARDS):
+    """Return new SeatShard entities holding conf.seatsAvailable and
+    mark the conference as sharded; the caller puts both."""
+    conf.seatShards = count
+    shards = [SeatShard(key=key, seatsAvailable=seats)
+              for key, seats in zip(_shardKeys(conf.key, count),
+                                    _distribute(conf.seatsAvailable, count))]
+    # attendees registered before the conference was sharded
+    shards[0].attendees = max(
+        (conf.maxAttendees or 0) - (conf.seatsAvailable or 0), 0)
+    return shards
+
+
+@ndb.transactional(xg=True)
+def _shardConference(conf_key):
+    """Move the seats of an unsharded conference onto seat shards."""
+    conf = conf_key.get()
+    if not conf.seatShards:
+        ndb.put_multi(createShards(conf) + [conf])
+    return conf
+
+
+def ensureShards(conf):
+    """Return conf, sharding its seat counter first if necessary
+    (conferences created before seat shards existed)."""
+    if conf.seatShards:
+        return conf
+    return _shardConference(conf.key)
+
+
+def shardKeys(conf):
+    """Return the keys of all seat shards of a sharded conference."""
+    return _shardKeys(conf.key, conf.seatShards)
+
+
+def candidateShards(conf):
+    """Return keys of shards that currently have seats, in random order.
+    The read is outside any transaction; the registration transaction
+    re-checks the chosen shard."""
+    shards = [shard for shard in ndb.get_multi(shardKeys(conf))
+              if shard and shard.seatsAvailable > 0]
+    random.shuffle(shards)
+    return [shard.key for shard in shards]
+
+
+def fullestShards(conf, limit):
+    """Return keys of at most limit shards with the most seats left."""
+    shards = [shard for shard in ndb.get_multi(shardKeys(conf))
+              if shard and shard.seatsAvailable > 0]
+    shards.sort(key=lambda shard: shard.seatsAvailable, reverse=True)
+    return [shard.key for shard in shards[:limit]]
+
+
+def randomShard(conf):
+    """Return the key of a random seat shard (used to give seats back)."""
+    return random.choice(shardKeys(conf))
+
+
+def seatsAvailable(conf):
+    """Return the exact number of available seats of a conference."""
+    if not conf.seatShards:
+        return conf.seatsAvailable
+    shards = ndb.get_multi(shardKeys(conf))
+    return sum(shard.seatsAvailable for shard in shards if shard)
+
+
+def attendeeCount(conf):
+    """Return the number of attendees registered for a conference."""
+    if not conf.seatShards:
+        return max((conf.maxAttendees or 0) - (conf.seatsAvailable or 0), 0)
+    shards = ndb.get_multi(shardKeys(conf))
+    return sum(shard.attendees for shard in shards if shard)
+
+
+def adjustSeats(conf, delta):
+    """Add (or, if negative, remove) delta seats to the shards of conf;
+    must run inside a cross-group transaction. Seats already taken are
+    never removed, so the result may be less negative than requested.
+    Returns the new total."""
+    shards = [shard for shard in ndb.get_multi(shardKeys(conf)) if shard]
+    if delta > 0:
+        for shard, seats in zip(shards, _distribute(delta, len(shards))):
+            shard.seatsAvailable += seats
+    else:
+        remaining = -delta
+        for shard in shards:
+            taken = min(shard.seatsAvailable, remaining)
+            shard.seatsAvailable -= taken
+            remaining -= taken
+    ndb.put_multi(shards)
+    return sum(shard.seatsAvailable for shard in shards)
+
+
+def scheduleReconcile(wsck):
+    """Enqueue (at most once per RECONCILE_INTERVAL) a task copying the
+    shard sum to Conference.seatsAvailable."""
+    # urlsafe keys only contain characters allowed in task names
+    name = 'reconcile-seats-%s-%d' % (
+        wsck, int(time.time() / RECONCILE_INTERVAL))
+    try:
+        taskqueue.add(name=name, params={'websafeConferenceKey': wsck},
+                      url='/tasks/reconcile_seats',
+                      countdown=RECONCILE_INTERVAL)
+    except (taskqueue.TaskAlreadyExistsError,
+            taskqueue.TombstonedTaskError):
+        pass
+
+
+def reconcile(wsck):
+    """Write the current shard sum to Conference.seatsAvailable."""
+    conf_key = ndb.Key(urlsafe=wsck)
+    conf = conf_key.get()
+    if not conf or not conf.seatShards:
+        return None
+    total = seatsAvailable(conf)
+
+    @ndb.transactional(xg=True)
+    def _store():
+        conf = conf_key.get()
+        if conf.seatsAvailable != total:
+            old_seats, conf.seatsAvailable = conf.seatsAvailable, total
+            conf.put()
+            # conferences crossing the threshold join or leave the
+            # nearly sold out announcement
+            announcements.update(conf, old_seats, conf.name)
+            return True
+        return False
+
+    # the cached ConferenceForm shows the reconciled seats
+    if _store():
+        caching.invalidateConference(wsck)
+        caching.invalidateCatalog()
+    return total
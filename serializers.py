@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+"""
+serializers.py -- precompiled entity to ProtoRPC message serializers
+
+For each pair of ndb model and outbound form a field plan is compiled
+once at import time: the list of form fields to fill together with the
+converter for their values (date/time to string, string to enum, key to
+websafe key). Serializing an entity then only runs the plan instead of
+inspecting all form fields with hasattr/endswith for every entity.
+
+List endpoints accept a field mask; a masked serializer runs only the
+part of the plan for the requested fields, and maskProjection() tells
+whether the masked fields can be fetched by a projection query.
+"""
+
+import copy
+
+from google.appengine.ext import ndb
+from conferencequery import loadIndexes
+from models import Conference
+from models import ConferenceForm
+from models import ConferenceListForm
+from models import Profile
+from models import ProfileForm
+from models import Registration
+from models import Session
+from models import SessionForm
+from models import Speaker
+from models import SpeakerForm
+from models import TeeShirtSize
+
+
+def _toString(value):
+    """Convert Date/Time (or any other value) to its string."""
+    return str(value)
+
+
+def _toEnum(enum_type):
+    """Return converter from enum value name to enum_type value."""
+    def convert(value):
+        return getattr(enum_type, value)
+    return convert
+
+
+class Serializer(object):
+    """Serializer -- compiled field plan from ndb model to form message"""
+
+    def __init__(self, model_cls, form_cls, converters=None):
+        self.form_cls = form_cls
+        converters = converters or {}
+        self.plan = []
+        self.websafeKey = False
+        for field in form_cls.all_fields():
+            prop = model_cls._properties.get(field.name)
+            if prop is None:
+                # websafeKey is derived from the entity key, other
+                # fields without property are filled by the caller
+                self.websafeKey |= field.name == 'websafeKey'
+                continue
+            convert = converters.get(field.name)
+            if convert is None:
+                if isinstance(prop, (ndb.DateProperty, ndb.TimeProperty)):
+                    convert = _toString
+            self.plan.append((field.name, convert))
+        self.mask = None
+        self.checkInitialized = any(
+            field.required for field in form_cls.all_fields())
+        self.fieldNames = frozenset(
+            field.name for field in form_cls.all_fields())
+
+    def masked(self, fields):
+        """Return serializer copying only the given fields, or self if
+        fields is empty (no mask)."""
+        if not fields:
+            return self
+        fields = frozenset(fields)
+        masked = copy.copy(self)
+        masked.plan = [(name, convert) for name, convert in self.plan
+                       if name in fields]
+        masked.websafeKey = self.websafeKey and 'websafeKey' in fields
+        masked.mask = fields
+        masked.checkInitialized = False
+        return masked
+
+    def keysOnly(self):
+        """Return True if the serializer needs entity keys only."""
+        return not self.plan and self.websafeKey
+
+    def fromKeys(self, keys):
+        """Return list of form messages holding only the websafe keys."""
+        form_cls = self.form_cls
+        return [form_cls(websafeKey=key.urlsafe()) for key in keys]
+
+    def toForm(self, entity, **extra):
+        """Return form message with the fields of entity, plus extra.
+        Of projected entities only the projected fields are copied."""
+        form = self.form_cls()
+        projection = entity._projection
+        for name, convert in self.plan:
+            if projection and name not in projection:
+                continue
+            value = getattr(entity, name)
+            if convert is not None and value is not None:
+                value = convert(value)
+            setattr(form, name, value)
+        if self.websafeKey:
+            form.websafeKey = entity.key.urlsafe()
+        for name, value in extra.items():
+            if value and (self.mask is None or name in self.mask):
+                setattr(form, name, value)
+        if self.checkInitialized:
+            form.check_initialized()
+        return form
+
+    def toForms(self, entities, **extra):
+        """Return list of form messages for all entities."""
+        toForm = self.toForm
+        return [toForm(entity, **extra) for entity in entities]
+
+
+_indexes = {}
+
+
+def maskProjection(serializer, model_cls, ancestor=False):
+    """Return property names to project for the fields copied by
+    serializer, or None if the entities have to be fetched in full
+    (a field is not an indexed single-valued property, or no index
+    serves the projection). A query without filters can project a
+    single property from its built-in index."""
+    names = sorted(name for name, convert in serializer.plan)
+    props = [model_cls._properties[name] for name in names]
+    if not names or any(not prop._indexed or prop._repeated
+                        for prop in props):
+        return None
+    if len(names) == 1 and not ancestor:
+        return names
+    kind = (model_cls._get_kind(), ancestor)
+    if kind not in _indexes:
+        _indexes[kind] = [sorted(props) for props in loadIndexes(
+            kind=kind[0], ancestor=ancestor)]
+    if names in _indexes[kind]:
+        return names
+    return None
+
+
+conferenceSerializer = Serializer(Conference, ConferenceForm)
+conferenceListSerializer = Serializer(Conference, ConferenceListForm)
+profileSerializer = Serializer(
+    Profile, ProfileForm, {'teeShirtSize': _toEnum(TeeShirtSize)})
+attendeeSerializer = Serializer(
+    Registration, ProfileForm, {'teeShirtSize': _toEnum(TeeShirtSize)})
+sessionSerializer = Serializer(Session, SessionForm)
+speakerSerializer = Serializer(Speaker, SpeakerForm)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+"""
+sessionquery.py -- query planner for sessions with several inequalities
+
+The datastore allows an inequality filter on one property per query only.
+The planner splits the predicates into keys-only sub-queries which only
+need built-in single property indexes (merge joins for the equality
+predicates, one query per property with inequalities), runs them
+concurrently with fetch_async and intersects their key sets. A sub-query
+returning more than SUBQUERY_LIMIT keys is not selective enough to be
+intersected; its predicates are evaluated in Python instead, as are all
+predicates on the fetched sessions to guard against stale index reads.
+If no sub-query is selective, the most selective one is scanned in
+batches and all predicates are evaluated in Python, provided it holds
+fewer than SCAN_LIMIT sessions; broader filters are rejected.
+"""
+
+import operator
+from datetime import datetime
+
+from google.appengine.ext import ndb
+
+from models import Session
+from models import SessionType
+
+SUBQUERY_LIMIT = 1000
+SCAN_LIMIT = 5000
+SCAN_BATCH = 500
+
+COMPARATORS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+
+def _toDate(value):
+    return datetime.strptime(value[:10], "%Y-%m-%d").date()
+
+
+def _toTime(value):
+    return datetime.strptime(
+        value if len(value) > 5 else value + ':00', "%H:%M:%S").time()
+
+
+def _toSessionType(value):
+    value = value.upper()
+    if value not in SessionType.names():
+        raise ValueError('unknown session type %s' % value)
+    return value
+
+
+CONVERTERS = {
+    'startTime': _toTime,
+    'startDate': _toDate,
+    'duration': int,
+    'sessionType': _toSessionType,
+    'topics': unicode,
+    'speaker': unicode,
+}
+
+
+class Predicate(object):
+    """Predicate -- comparison of a Session property with a value"""
+
+    def __init__(self, field, op, value):
+        self.field = field
+        self.op = op
+        self.value = CONVERTERS[field](value)
+
+    def node(self):
+        """Return datastore filter node of the predicate."""
+        return ndb.query.FilterNode(self.field, self.op, self.value)
+
+    def matches(self, session):
+        """Evaluate the predicate on a session in Python."""
+        compare = COMPARATORS[self.op]
+        value = getattr(session, self.field)
+        if isinstance(value, list):
+            # repeated properties match if any of their values match
+            return any(compare(v, self.value) for v in value)
+        return value is not None and compare(value, self.value)
+
+    def __str__(self):
+        return '%s%s%s' % (self.field, self.op, self.value)
+
+
+def _subQueries(predicates, ancestor):
+    """Return list of (predicates, query) pairs: one for all equality
+    predicates (and the ancestor), one per field with inequalities."""
+    equalities = [p for p in predicates if p.op == '=']
+    inequalities = {}
+    for p in predicates:
+        if p.op != '=':
+            inequalities.setdefault(p.field, []).append(p)
+
+    plans = []
+    if equalities or ancestor or not inequalities:
+        q = Session.query(ancestor=ancestor)
+        for p in equalities:
+            q = q.filter(p.node())
+        plans.append((equalities, q))
+    for field in sorted(inequalities):
+        q = Session.query()
+        for p in inequalities[field]:
+            q = q.filter(p.node())
+        plans.append((inequalities[field], q))
+    return plans
+
+
+def _scan(plans, predicates, ancestor):
+    """Return (sessions, plan description) of the scan of the most
+    selective sub-query, evaluating all predicates in Python; raise
+    ValueError if every sub-query holds SCAN_LIMIT sessions or more."""
+    counts = [q.count_async(SCAN_LIMIT) for preds, q in plans]
+    counts = [count.get_result() for count in counts]
+    if min(counts) >= SCAN_LIMIT:
+        raise ValueError('Filter too broad: every sub-query matches at '
+                         'least %d sessions' % SCAN_LIMIT)
+    preds, q = plans[counts.index(min(counts))]
+    sessions = [s for s in q.iter(batch_size=SCAN_BATCH, limit=SCAN_LIMIT)
+                if (ancestor is None or s.key.parent() == ancestor)
+                and all(p.matches(s) for p in predicates)]
+    label = ' & '.join(str(p) for p in preds) or \
+        ('ancestor' if ancestor else 'all')
+    return sessions, 'scan[%s (%d keys)] postfilter[all] -> %d sessions' % (
+        label, min(counts), len(sessions))
+
+
+def querySessions(predicates, ancestor=None):
+    """Return (sessions, plan description) matching all predicates."""
+    plans = _subQueries(predicates, ancestor)
+    futures = [q.fetch_async(SUBQUERY_LIMIT + 1, keys_only=True)
+               for preds, q in plans]
+
+    keys = None
+    used, skipped = [], []
+    for (preds, q), future in zip(plans, futures):
+        result = future.get_result()
+        label = ' & '.join(str(p) for p in preds) or \
+            ('ancestor' if ancestor else 'all')
+        if len(result) > SUBQUERY_LIMIT:
+            skipped.append(label)
+            continue
+        used.append('%s (%d keys)' % (label, len(result)))
+        keys = set(result) if keys is None else keys.intersection(result)
+
+    if keys is None:
+        # no selective sub-query: scan one instead of intersecting
+        sessions, plan = _scan(plans, predicates, ancestor)
+    else:
+        # keep sessions of the conference only and evaluate all predicates
+        sessions = [s for s in ndb.get_multi(list(keys))
+                    if s and (ancestor is None or s.key.parent() == ancestor)
+                    and all(p.matches(s) for p in predicates)]
+        plan = 'intersect[%s]' % '; '.join(used)
+        if skipped:
+            plan += ' postfilter[%s]' % '; '.join(skipped)
+        plan += ' -> %d of %d sessions' % (len(sessions), len(keys))
+    sessions.sort(key=lambda s: (s.startDate, s.startTime, s.name))
+    return sessions, plan
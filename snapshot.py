@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+
+"""
+snapshot.py -- streaming JSONL export and import of the dataset
+
+Every Profile, Conference, Speaker and Session is written as one JSON
+line holding its full key path (so ancestors are preserved) and its
+properties. Properties holding websafe keys are written as key paths as
+well, so a snapshot can be restored into another application.
+
+exportAll() and importAll() stream to and from file objects (wrap them
+in gzip.GzipFile for compression) and can run against the local
+datastore stub. Inside the application a snapshot is exported page by
+page into SnapshotChunk entities by chained tasks, one chunk per task;
+chunks are downloaded and uploaded one at a time and restored by
+chained tasks that write with parallel put_multi batches.
+
+Derived entities (seat shards, registrations, wishlist entries, speaker
+session counts) are not exported; they are rebuilt after a restore.
+"""
+
+import gzip
+import json
+from cStringIO import StringIO
+from datetime import datetime
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Profile
+from models import Session
+from models import Snapshot
+from models import SnapshotChunk
+from models import Speaker
+
+import announcements
+import caching
+
+KINDS = (Profile, Conference, Speaker, Session)
+MODELS = dict((model_cls._get_kind(), model_cls) for model_cls in KINDS)
+# properties holding websafe keys
+KEY_PROPERTIES = {
+    'Profile': ('conferenceKeysToAttend', 'sessionKeysWishlist'),
+    'Session': ('speaker',),
+}
+EXPORT_BATCH = 200
+CHUNK_PAGES = 5
+IMPORT_BATCH = 100
+PARALLEL_BATCHES = 5
+CHUNK_BYTES = 512 * 1024    # uploaded lines per chunk (before compression)
+
+
+# - - - entity encoding - - - - - - - - - - - - - - - - - - -
+
+def _encodeKeyString(value):
+    """Return key path of websafe key value (value itself if no key)."""
+    try:
+        return list(ndb.Key(urlsafe=value).flat())
+    except Exception:
+        return value
+
+
+def _decodeKeyString(value):
+    """Return websafe key of a key path written by _encodeKeyString."""
+    if isinstance(value, list):
+        return ndb.Key(flat=value).urlsafe()
+    return value
+
+
+def _parseTime(value, fmt):
+    """Parse isoformat() output, with or without microseconds."""
+    if '.' in value:
+        fmt += '.%f'
+    return datetime.strptime(value, fmt)
+
+
+def _decodeValue(prop, value):
+    """Convert a JSON value back to the value type of prop."""
+    if value is None:
+        return None
+    # DateProperty and TimeProperty subclass DateTimeProperty
+    if isinstance(prop, ndb.DateProperty):
+        return _parseTime(value, '%Y-%m-%d').date()
+    if isinstance(prop, ndb.TimeProperty):
+        return _parseTime(value, '%H:%M:%S').time()
+    if isinstance(prop, ndb.DateTimeProperty):
+        return _parseTime(value, '%Y-%m-%dT%H:%M:%S')
+    return value
+
+
+def encodeEntity(entity):
+    """Return JSON-serializable record of entity."""
+    kind = entity._get_kind()
+    key_props = KEY_PROPERTIES.get(kind, ())
+    props = {}
+    for name, prop in entity._properties.items():
+        value = prop._get_value(entity)
+        if prop._repeated:
+            values = value
+        else:
+            values = [value]
+        if name in key_props:
+            values = [_encodeKeyString(v) if v else v for v in values]
+        values = [v.isoformat() if hasattr(v, 'isoformat') else v
+                  for v in values]
+        props[name] = values if prop._repeated else values[0]
+    return {'key': list(entity.key.flat()), 'properties': props}
+
+
+def decodeEntity(record):
+    """Return entity of a record written by encodeEntity."""
+    key = ndb.Key(flat=record['key'])
+    model_cls = MODELS.get(key.kind())
+    if model_cls is None:
+        raise ValueError('Unknown kind in snapshot: %s' % key.kind())
+    key_props = KEY_PROPERTIES.get(key.kind(), ())
+    entity = model_cls(key=key)
+    for name, value in record['properties'].items():
+        prop = model_cls._properties.get(name)
+        if prop is None:
+            continue
+        values = value if prop._repeated else [value]
+        values = [_decodeValue(prop, v) for v in values]
+        if name in key_props:
+            values = [_decodeKeyString(v) for v in values]
+        prop._set_value(entity, values if prop._repeated else values[0])
+    if isinstance(entity, Conference):
+        # seat shards are not exported; reshard from seatsAvailable
+        entity.seatShards = 0
+    return entity
+
+
+# - - - streams - - - - - - - - - - - - - - - - - - - - - - -
+
+def exportPage(model_cls, out, websafeCursor=None):
+    """Write one page of entities of model_cls as JSON lines to out;
+    return the number written and the websafe cursor of the next page
+    (None when done)."""
+    entities, cursor, more = model_cls.query().fetch_page(
+        EXPORT_BATCH, start_cursor=ndb.Cursor(urlsafe=websafeCursor)
+        if websafeCursor else None)
+    for entity in entities:
+        out.write(json.dumps(encodeEntity(entity), sort_keys=True))
+        out.write('\n')
+    return len(entities), (cursor.urlsafe() if more and cursor else None)
+
+
+def exportAll(out, kinds=KINDS):
+    """Write all entities of kinds as JSON lines to out, one page in
+    memory at a time; return the number of entities written."""
+    count = 0
+    for model_cls in kinds:
+        cursor = None
+        while True:
+            n, cursor = exportPage(model_cls, out, cursor)
+            count += n
+            if not cursor:
+                break
+    return count
+
+
+def putAll(entities):
+    """Put entities (any iterable) with up to PARALLEL_BATCHES
+    put_multi batches in flight; return the number of entities put."""
+    pending, batch, count = [], [], 0
+
+    def flush(batch):
+        pending.append(ndb.put_multi_async(batch))
+        if len(pending) >= PARALLEL_BATCHES:
+            for future in pending.pop(0):
+                future.get_result()
+
+    for entity in entities:
+        batch.append(entity)
+        count += 1
+        if len(batch) == IMPORT_BATCH:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    for futures in pending:
+        for future in futures:
+            future.get_result()
+    return count
+
+
+def importAll(lines):
+    """Put the entities of JSON lines (any iterable, e.g. a file);
+    return the number of entities put."""
+    return putAll(decodeEntity(json.loads(line))
+                  for line in lines if line.strip())
+
+
+def gzipped(data):
+    """Return data compressed as a gzip stream."""
+    buf = StringIO()
+    f = gzip.GzipFile(fileobj=buf, mode='wb')
+    f.write(data)
+    f.close()
+    return buf.getvalue()
+
+
+def gunzipped(data):
+    """Return data decompressed from a gzip stream."""
+    return gzip.GzipFile(fileobj=StringIO(data)).read()
+
+
+# - - - snapshots in chunks - - - - - - - - - - - - - - - - -
+
+def snapshotKey(name):
+    """Return key of the Snapshot called name."""
+    return ndb.Key(Snapshot, name)
+
+
+def chunkKey(name, chunk):
+    """Return key of chunk number chunk (starting at 1) of a snapshot."""
+    return ndb.Key(SnapshotChunk, chunk, parent=snapshotKey(name))
+
+
+@ndb.transactional()
+def _addChunk(name, chunk, data, entities):
+    """Store chunk of snapshot name (appended if chunk is None) and
+    count it, once (tasks may be retried)."""
+    snap = snapshotKey(name).get()
+    chunk = chunk or snap.chunks + 1
+    if chunkKey(name, chunk).get():
+        return snap
+    snap.chunks = max(snap.chunks, chunk)
+    snap.entities += entities
+    ndb.put_multi([snap, SnapshotChunk(key=chunkKey(name, chunk),
+                                       data=data, entities=entities)])
+    return snap
+
+
+def startExport(name):
+    """Start the export of a new snapshot in chained tasks; return the
+    Snapshot."""
+    snap = Snapshot(key=snapshotKey(name))
+    snap.put()
+    taskqueue.add(params={'name': name, 'kind': 0, 'chunk': 1},
+                  url='/tasks/export_snapshot')
+    return snap
+
+
+def exportChunk(name, kind, websafeCursor, chunk):
+    """Export up to CHUNK_PAGES pages of KINDS[kind] into one chunk and
+    chain the task for the next chunk (or mark the snapshot done)."""
+    out = StringIO()
+    count = 0
+    for _ in range(CHUNK_PAGES):
+        n, websafeCursor = exportPage(KINDS[kind], out, websafeCursor)
+        count += n
+        if not websafeCursor:
+            break
+    if count:
+        _addChunk(name, chunk, out.getvalue(), count)
+        chunk += 1
+    if not websafeCursor:
+        kind += 1
+    if kind < len(KINDS):
+        taskqueue.add(params={'name': name, 'kind': kind, 'chunk': chunk,
+                              'cursor': websafeCursor or ''},
+                      url='/tasks/export_snapshot')
+    else:
+        snap = snapshotKey(name).get()
+        snap.status = 'DONE'
+        snap.put()
+
+
+def readChunk(name, chunk, compressed=False):
+    """Return the JSON lines of a chunk (None if it does not exist)."""
+    entity = chunkKey(name, chunk).get()
+    if not entity:
+        return None
+    return gzipped(entity.data) if compressed else entity.data
+
+
+def uploadChunk(name, data, compressed=False):
+    """Append uploaded JSON lines (gzip stream if compressed) to
+    snapshot name as new chunks of at most CHUNK_BYTES; return the
+    Snapshot."""
+    if compressed:
+        data = gunzipped(data)
+    snap = snapshotKey(name).get()
+    if not snap:
+        snap = Snapshot(key=snapshotKey(name), status='UPLOADING')
+        snap.put()
+    lines, size = [], 0
+    for line in data.splitlines(True):
+        if not line.strip():
+            continue
+        lines.append(line)
+        size += len(line)
+        if size >= CHUNK_BYTES:
+            snap = _addChunk(name, None, ''.join(lines), len(lines))
+            lines, size = [], 0
+    if lines:
+        snap = _addChunk(name, None, ''.join(lines), len(lines))
+    return snap
+
+
+def startRestore(name):
+    """Start restoring snapshot name in chained tasks; return the
+    Snapshot (None if it does not exist)."""
+    snap = snapshotKey(name).get()
+    if snap:
+        snap.status = 'RESTORING'
+        snap.restored = 0
+        snap.restoredChunks = []
+        snap.put()
+        taskqueue.add(params={'name': name, 'chunk': 1},
+                      url='/tasks/restore_snapshot')
+    return snap
+
+
+@ndb.transactional()
+def _countRestored(name, chunk, entities):
+    """Count the restored entities of chunk, once (tasks may be
+    retried); return the Snapshot."""
+    snap = snapshotKey(name).get()
+    if chunk not in snap.restoredChunks:
+        snap.restoredChunks.append(chunk)
+        snap.restored += entities
+        snap.put()
+    return snap
+
+
+def restoreChunk(name, chunk):
+    """Put the entities of one chunk and chain the task for the next
+    one; after the last chunk rebuild the derived entities."""
+    snap = snapshotKey(name).get()
+    entity = chunkKey(name, chunk).get()
+    if entity:
+        entities = [decodeEntity(json.loads(line))
+                    for line in entity.data.splitlines() if line.strip()]
+        # putting a chunk again is harmless, counting it again is not
+        snap = _countRestored(name, chunk, putAll(entities))
+        # drop cached profiles and conference forms of restored entities
+        caching.invalidateProfiles([e.key.id() for e in entities
+                                    if isinstance(e, Profile)])
+        for user_id in set(e.organizerUserId for e in entities
+                           if isinstance(e, Conference)):
+            caching.invalidateOrganizer(user_id)
+    if chunk < snap.chunks:
+        taskqueue.add(params={'name': name, 'chunk': chunk + 1},
+                      url='/tasks/restore_snapshot')
+        return
+    snap.status = 'RESTORED'
+    snap.put()
+    caching.invalidateCatalog()
+    announcements.reconcile()
+    taskqueue.add(url='/tasks/backfill_registrations')
+    taskqueue.add(url='/tasks/rebuild_speaker_sessions')
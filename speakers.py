@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+"""
+speakers.py -- incrementally maintained sessions per speaker
+
+For every speaker a SpeakerSessions entity (id 'all') and one per
+conference (id websafe conference key) hold the number, keys and names
+of the speaker's sessions. They are children of the Speaker and are
+updated in the same cross-group transaction that creates or deletes a
+session, so the featured speaker can be determined without querying the
+sessions.
+
+The overall SpeakerSessions doubles as the speaker-to-sessions index
+used by getSessionsBySpeaker.
+"""
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+import caching
+from models import Session
+from models import Speaker
+from models import SpeakerSessions
+
+MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED SPEAKER"
+MEMCACHE_FEATURED_SPEAKER_ID_KEY = "FEATURED SPEAKER ID"
+MEMCACHE_CONF_FEATURED_SPEAKER_KEY = "FEATURED SPEAKER:%s"
+FEATURED_SPEAKER_TPL = ('Speaker %s features in the following sessions: %s')
+FEATURED_MIN_SESSIONS = 2
+ALL_SESSIONS = 'all'
+REBUILD_BATCH = 100
+
+
+def statsKeys(wsspk, wsck):
+    """Return keys of the overall and per-conference SpeakerSessions."""
+    sp_key = ndb.Key(urlsafe=wsspk)
+    return [ndb.Key(SpeakerSessions, ALL_SESSIONS, parent=sp_key),
+            ndb.Key(SpeakerSessions, wsck, parent=sp_key)]
+
+
+def newSpeakerSessions(sp_key):
+    """Return the empty overall SpeakerSessions of a new speaker."""
+    return SpeakerSessions(
+        key=ndb.Key(SpeakerSessions, ALL_SESSIONS, parent=sp_key))
+
+
+def speakerSessions(wsspk):
+    """Return the overall SpeakerSessions of a speaker (None if the
+    speaker has not been indexed yet)."""
+    return ndb.Key(SpeakerSessions, ALL_SESSIONS,
+                   parent=ndb.Key(urlsafe=wsspk)).get()
+
+
+def _conferenceKey(session):
+    """Return websafe key of the conference of a session."""
+    return session.key.parent().urlsafe()
+
+
+def addSessions(sessions):
+    """Count sessions (with a speaker) for their speakers, reading and
+    writing each SpeakerSessions once; must run in a transaction."""
+    keys = list(set(key for session in sessions
+                    for key in statsKeys(session.speaker,
+                                         _conferenceKey(session))))
+    stats = dict((key, st or SpeakerSessions(key=key))
+                 for key, st in zip(keys, ndb.get_multi(keys)))
+    for session in sessions:
+        wssk = session.key.urlsafe()
+        for key in statsKeys(session.speaker, _conferenceKey(session)):
+            st = stats[key]
+            if wssk not in st.sessionKeys:
+                st.sessionKeys.append(wssk)
+                st.sessionNames.append(session.name)
+                st.sessionCount = len(st.sessionKeys)
+    ndb.put_multi(stats.values())
+    return stats.values()
+
+
+def removeSession(session):
+    """Uncount session for its speaker; must run in a transaction."""
+    keys = statsKeys(session.speaker, _conferenceKey(session))
+    stats = [st for st in ndb.get_multi(keys) if st]
+    wssk = session.key.urlsafe()
+    for st in stats:
+        if wssk in st.sessionKeys:
+            i = st.sessionKeys.index(wssk)
+            del st.sessionKeys[i]
+            del st.sessionNames[i]
+            st.sessionCount = len(st.sessionKeys)
+    ndb.put_multi(stats)
+    return stats
+
+
+def deleteSpeaker(wsspk):
+    """Delete the SpeakerSessions of a speaker and drop the featured
+    speaker entries naming the speaker."""
+    stats_keys = SpeakerSessions.query(
+        ancestor=ndb.Key(urlsafe=wsspk)).fetch(keys_only=True)
+    ndb.delete_multi(stats_keys)
+
+    cached = memcache.get_multi(
+        [MEMCACHE_FEATURED_SPEAKER_ID_KEY] +
+        [MEMCACHE_CONF_FEATURED_SPEAKER_KEY % key.id()
+         for key in stats_keys if key.id() != ALL_SESSIONS])
+    stale = [key for key, value in cached.items()
+             if key != MEMCACHE_FEATURED_SPEAKER_ID_KEY and value[0] == wsspk]
+    if cached.get(MEMCACHE_FEATURED_SPEAKER_ID_KEY) == wsspk:
+        stale += [MEMCACHE_FEATURED_SPEAKER_KEY,
+                  MEMCACHE_FEATURED_SPEAKER_ID_KEY]
+    if stale:
+        memcache.delete_multi(stale)
+    if MEMCACHE_FEATURED_SPEAKER_KEY in stale:
+        caching.touchGlobal(MEMCACHE_FEATURED_SPEAKER_KEY)
+
+
+def _featuredText(speaker, stats):
+    """Return featured speaker text of speaker with sessions stats."""
+    return FEATURED_SPEAKER_TPL % (
+        speaker.firstName + ' ' + speaker.familyName,
+        ', '.join(stats.sessionNames))
+
+
+def cacheFeaturedSpeaker(wsspk, wsck=None):
+    """Set speaker as featured speaker in memcache (overall and for the
+    conference) if speaker features in at least 2 sessions, and drop
+    entries still naming the speaker otherwise."""
+    keys = statsKeys(wsspk, wsck or ALL_SESSIONS)
+    speaker, stats_all, stats_conf = ndb.get_multi(
+        [keys[0].parent()] + keys)
+    conf_key = MEMCACHE_CONF_FEATURED_SPEAKER_KEY % wsck
+    current = memcache.get_multi(
+        [MEMCACHE_FEATURED_SPEAKER_ID_KEY] + ([conf_key] if wsck else []))
+
+    mapping, stale = {}, []
+    if speaker and stats_all and \
+            stats_all.sessionCount >= FEATURED_MIN_SESSIONS:
+        mapping[MEMCACHE_FEATURED_SPEAKER_KEY] = \
+            _featuredText(speaker, stats_all)
+        mapping[MEMCACHE_FEATURED_SPEAKER_ID_KEY] = wsspk
+    elif current.get(MEMCACHE_FEATURED_SPEAKER_ID_KEY) == wsspk:
+        stale += [MEMCACHE_FEATURED_SPEAKER_KEY,
+                  MEMCACHE_FEATURED_SPEAKER_ID_KEY]
+
+    # per-conference entries are (speaker key, text) tuples
+    if wsck:
+        if speaker and stats_conf and \
+                stats_conf.sessionCount >= FEATURED_MIN_SESSIONS:
+            mapping[conf_key] = (wsspk, _featuredText(speaker, stats_conf))
+        elif current.get(conf_key, ('',))[0] == wsspk:
+            stale.append(conf_key)
+
+    if mapping:
+        memcache.set_multi(mapping)
+    if stale:
+        memcache.delete_multi(stale)
+    # the overall featured speaker is also cached in every instance
+    if MEMCACHE_FEATURED_SPEAKER_KEY in mapping or \
+            MEMCACHE_FEATURED_SPEAKER_KEY in stale:
+        caching.touchGlobal(MEMCACHE_FEATURED_SPEAKER_KEY)
+
+
+def featuredSpeakers(wscks):
+    """Return featured speaker texts of conferences wscks (get_multi)."""
+    cached = memcache.get_multi(
+        [MEMCACHE_CONF_FEATURED_SPEAKER_KEY % wsck for wsck in wscks])
+    return [cached.get(MEMCACHE_CONF_FEATURED_SPEAKER_KEY % wsck,
+                       ('', ''))[1] for wsck in wscks]
+
+
+def rebuild(wsspk):
+    """Recompute the SpeakerSessions of a speaker from its sessions
+    (one-off backfill for sessions created before they existed)."""
+    sessions = Session.query(Session.speaker == wsspk).fetch()
+    all_key = statsKeys(wsspk, ALL_SESSIONS)[0]
+    stats = {all_key: SpeakerSessions(key=all_key)}
+    for session in sessions:
+        for key in statsKeys(wsspk, _conferenceKey(session)):
+            st = stats.setdefault(key, SpeakerSessions(key=key))
+            st.sessionKeys.append(session.key.urlsafe())
+            st.sessionNames.append(session.name)
+            st.sessionCount = len(st.sessionKeys)
+    ndb.put_multi(stats.values())
+
+
+def rebuildAll(websafeCursor=None):
+    """Rebuild the SpeakerSessions of one batch of speakers; return the
+    websafe cursor of the next batch or None when done."""
+    speaker_keys, cursor, more = Speaker.query().fetch_page(
+        REBUILD_BATCH, keys_only=True,
+        start_cursor=ndb.Cursor(urlsafe=websafeCursor)
+        if websafeCursor else None)
+    for key in speaker_keys:
+        rebuild(key.urlsafe())
+    return cursor.urlsafe() if more and cursor else None
@@ -423,13 +423,24 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
         }
     };
 
+    /**
+     * Holds the page token returned by the last queryConferences call.
+     * @type {string}
+     */
+    $scope.nextPageToken = null;
+
     /**
      * Invokes the conference.queryConferences API.
+     *
+     * @param more if true, the next page is appended to the current results.
      */
-    $scope.queryConferencesAll = function () {
+    $scope.queryConferencesAll = function (more) {
         var sendFilters = {
             filters: []
         }
+        if (more && $scope.nextPageToken) {
+            sendFilters.cursor = $scope.nextPageToken;
+        }
         for (var i = 0; i < $scope.filters.length; i++) {
             var filter = $scope.filters[i];
             if (filter.field && filter.operator && filter.value) {
@@ -458,10 +469,13 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
 
-                        $scope.conferences = [];
+                        if (!more) {
+                            $scope.conferences = [];
+                        }
                         angular.forEach(resp.items, function (conference) {
                             $scope.conferences.push(conference);
                         });
+                        $scope.nextPageToken = resp.nextPageToken || null;
                     }
                     $scope.submitted = true;
                 });
@@ -547,7 +561,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
  * @description
  * A controller used for the conference detail page.
  */
-conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, $timeout, HTTP_ERRORS) {
     $scope.conference = {};
 
     $scope.isUserAttending = false;
@@ -624,21 +638,46 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
                         return;
                     }
                 } else {
-                    if (resp.result) {
-                        // Register succeeded.
-                        $scope.messages = 'Registered for the conference';
-                        $scope.alertStatus = 'success';
-                        $scope.isUserAttending = true;
-                        $scope.conference.seatsAvailable = $scope.conference.seatsAvailable - 1;
-                    } else {
-                        $scope.messages = 'Failed to register for the conference';
-                        $scope.alertStatus = 'warning';
-                    }
+                    $scope.showRegistrationStatus(resp.result);
                 }
             });
         });
     };
 
+    /**
+     * Shows the result of a registration; queued registrations of hot
+     * conferences are polled with conference.getRegistrationStatus.
+     */
+    $scope.showRegistrationStatus = function (result) {
+        if (result && result.status == 'PENDING') {
+            $scope.messages = 'Your registration is queued, please wait';
+            $scope.alertStatus = 'info';
+            $timeout(function () {
+                gapi.client.conference.getRegistrationStatus({
+                    ticket: result.ticket
+                }).execute(function (resp) {
+                    $scope.$apply(function () {
+                        if (!resp.error) {
+                            $scope.showRegistrationStatus(resp.result);
+                        }
+                    });
+                });
+            }, 2000);
+        } else if (result && result.data) {
+            // Register succeeded.
+            $scope.messages = 'Registered for the conference';
+            $scope.alertStatus = 'success';
+            $scope.isUserAttending = true;
+            $scope.conference.seatsAvailable = $scope.conference.seatsAvailable - 1;
+        } else {
+            $scope.messages = 'Failed to register for the conference';
+            if (result && result.reason) {
+                $scope.messages += ' : ' + result.reason;
+            }
+            $scope.alertStatus = 'warning';
+        }
+    };
+
     /**
      * Invokes the conference.unregisterForConference method.
      */
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+"""
+test_snapshot.py -- round trip of entities through the snapshot records
+
+Run from the project directory with the App Engine SDK on PYTHONPATH:
+
+    python -m unittest discover tests
+"""
+
+import json
+import os
+import sys
+import unittest
+from datetime import date, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+os.environ.setdefault('APPLICATION_ID', 'dev~test')
+
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Profile
+from models import Session
+
+import snapshot
+
+
+class EntityRoundTripTest(unittest.TestCase):
+
+    def roundTrip(self, entity):
+        record = json.loads(json.dumps(snapshot.encodeEntity(entity)))
+        return snapshot.decodeEntity(record)
+
+    def testConferenceDates(self):
+        conf = Conference(
+            key=ndb.Key(Conference, 1, parent=ndb.Key(Profile, 'user')),
+            name='Conf', organizerUserId='user', city='London',
+            startDate=date(2016, 3, 4), endDate=date(2016, 3, 5), month=3,
+            maxAttendees=10, seatsAvailable=10, seatShards=20)
+        restored = self.roundTrip(conf)
+        self.assertEqual(restored.key, conf.key)
+        self.assertEqual(restored.startDate, date(2016, 3, 4))
+        self.assertEqual(restored.endDate, date(2016, 3, 5))
+        self.assertEqual(restored.seatsAvailable, 10)
+        self.assertEqual(restored.seatShards, 0)
+
+    def testSessionDateAndTime(self):
+        conf_key = ndb.Key(Conference, 1, parent=ndb.Key(Profile, 'user'))
+        session = Session(
+            key=ndb.Key(Session, 2, parent=conf_key), name='Session',
+            topics=['Web'], startDate=date(2016, 3, 4),
+            startTime=time(19, 0), duration=60)
+        restored = self.roundTrip(session)
+        self.assertEqual(restored.key, session.key)
+        self.assertEqual(restored.startDate, date(2016, 3, 4))
+        self.assertEqual(restored.startTime, time(19, 0))
+        self.assertEqual(restored.topics, ['Web'])
+
+
+if __name__ == '__main__':
+    unittest.main()
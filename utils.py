@@ -1,11 +1,66 @@
+import hashlib
 import json
 import os
 import time
 import uuid
 
+from google.appengine.api import memcache
 from google.appengine.api import urlfetch
 from models import Profile
 
+from caching import LRUCache
+
+TOKENINFO_URL = 'https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
+TOKENINFO_ATTEMPTS = 3
+TOKENINFO_BUDGET = 5.0      # seconds for all attempts of one token
+TOKENINFO_TIMEOUT = 1.0     # seconds for the first attempt, doubled later
+TOKENINFO_BACKOFF = 0.2     # seconds before the first retry, doubled later
+
+MEMCACHE_TOKEN_KEY = "TOKEN_USER_ID:%s"
+MEMCACHE_EMAIL_KEY = "EMAIL_USER_ID:%s"
+USER_ID_CACHE_TIME = 3600   # seconds
+USER_ID_LOCAL_SIZE = 1000
+
+# verified tokens (by token hash) and user ids (by email) of this instance
+_tokens = LRUCache(USER_ID_LOCAL_SIZE, USER_ID_CACHE_TIME)
+_emails = LRUCache(USER_ID_LOCAL_SIZE, USER_ID_CACHE_TIME)
+
+
+def _verifyToken(token):
+    """Return tokeninfo of token ({} if it cannot be verified). Failed
+    attempts are retried after an exponential backoff with a longer
+    timeout; all attempts together end within TOKENINFO_BUDGET."""
+    token_type = 'id_token'
+    if 'OAUTH_USER_ID' in os.environ:
+        token_type = 'access_token'
+    deadline = time.time() + TOKENINFO_BUDGET
+    timeout = TOKENINFO_TIMEOUT
+    backoff = TOKENINFO_BACKOFF
+    for i in range(TOKENINFO_ATTEMPTS):
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        try:
+            resp = urlfetch.fetch(TOKENINFO_URL % (token_type, token),
+                                  deadline=min(timeout, remaining))
+        except urlfetch.Error:
+            resp = None
+        if resp is None or resp.status_code >= 500:
+            # failing endpoint: back off (within the budget) before
+            # the next attempt
+            if i + 1 < TOKENINFO_ATTEMPTS:
+                time.sleep(max(min(backoff, deadline - time.time()), 0))
+            timeout *= 2
+            backoff *= 2
+        elif resp.status_code == 200:
+            return json.loads(resp.content)
+        elif resp.status_code == 400 and 'invalid_token' in resp.content \
+                and token_type == 'id_token':
+            token_type = 'access_token'
+        else:
+            break               # rejected, retrying will not help
+    return {}
+
 
 def getUserId(user, id_type="email"):
     if id_type == "email":
@@ -15,32 +70,44 @@ def getUserId(user, id_type="email"):
         """A workaround implementation for getting userid."""
         auth = os.getenv('HTTP_AUTHORIZATION')
         bearer, token = auth.split()
-        token_type = 'id_token'
-        if 'OAUTH_USER_ID' in os.environ:
-            token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
-            else:
-                time.sleep(wait)
-                wait = wait + i
-        return user.get('user_id', '')
+        # verified tokens are cached by hash until they expire
+        token_hash = hashlib.sha256(token).hexdigest()
+        user_id = _tokens.get(token_hash)
+        if user_id is not None:
+            return user_id
+        entry = memcache.get(MEMCACHE_TOKEN_KEY % token_hash)
+        if entry is None:
+            info = _verifyToken(token)
+            if not info.get('user_id'):
+                return ''
+            expires_in = int(info.get('expires_in', 0))
+            entry = (time.time() + expires_in, info['user_id'])
+            if expires_in > 0:
+                memcache.set(MEMCACHE_TOKEN_KEY % token_hash, entry,
+                             time=expires_in)
+        expires, user_id = entry
+        if expires > time.time():
+            _tokens.set(token_hash, user_id, ttl=expires - time.time())
+        return user_id
 
     if id_type == "custom":
-        # implement your own user_id creation and getting algorythm
-        # this is just a sample that queries datastore for an existing profile
-        # and generates an id if profile does not exist for an email
-        profile = Conference.query(Conference.mainEmail == user.email())
-        if profile:
-            return profile.id()
-        else:
-            return str(uuid.uuid1().get_hex())
+        # the id of the profile with the user's email (an indexed query),
+        # or a new id for users without profile; cached, so concurrent
+        # and later requests of a user get the same id
+        email = user.email()
+        user_id = _emails.get(email)
+        if user_id is not None:
+            return user_id
+        user_id = memcache.get(MEMCACHE_EMAIL_KEY % email)
+        if user_id is None:
+            p_key = Profile.query(Profile.mainEmail == email).get(
+                keys_only=True)
+            if p_key:
+                user_id = p_key.id()
+            else:
+                user_id = str(uuid.uuid1().get_hex())
+            if not memcache.add(MEMCACHE_EMAIL_KEY % email, user_id,
+                                time=USER_ID_CACHE_TIME):
+                user_id = memcache.get(MEMCACHE_EMAIL_KEY % email) or user_id
+        _emails.set(email, user_id)
+        return user_id
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+
+"""
+wishlists.py -- reverse index from sessions to the users wishing them
+
+Every session key in Profile.sessionKeysWishlist has a WishlistEntry
+child of the Profile, written in the same transaction, so the profiles
+wishing a session are found with a keys-only query on
+WishlistEntry.session instead of an index on the repeated wishlist
+property of every Profile.
+"""
+
+from google.appengine.ext import ndb
+
+from models import WishlistEntry
+
+
+def entryKey(p_key, wssk):
+    """Return key of the WishlistEntry of a profile for a session."""
+    return ndb.Key(WishlistEntry, wssk, parent=p_key)
+
+
+def newEntry(p_key, wssk):
+    """Return new WishlistEntry of profile p_key for session wssk."""
+    return WishlistEntry(key=entryKey(p_key, wssk), session=wssk)
+
+
+def entriesQuery(wssk):
+    """Return query for the wishlist entries of session wssk."""
+    return WishlistEntry.query(WishlistEntry.session == wssk)
+
+
+def wishlisterKeys(wssk):
+    """Return keys of all profiles having session wssk in their wishlist."""
+    return [key.parent() for key in entriesQuery(wssk).iter(keys_only=True)]